@@ -8,15 +8,18 @@ from abc import ABC, abstractmethod
 
 import random
 
-from .configs import Agent_Type, AI_DEPTH
+from .configs import Agent_Type, AI_DEPTH, LOSS, WIN, TT_SIZE, ASPIRATION_WINDOW
 from .base import *
+from .bitboard import BitBoard
+from .clock import TimeControl
+from .search import Searcher
+from .parallel import ParallelSearcher
+from .engine import Engine
+from .book import OpeningBook, BOOK_FILE
 from .utils import threaded
 from .network import GameClient
 
 
-LOSS, WIN = -1000_000, 1000_000
-
-
 def agent_make_move(agent):
     agent.make_move()
 
@@ -52,16 +55,30 @@ class Bot(Agent):
     def is_busy(self):
         return self._busy
 
+    @property
+    def is_connected(self):
+        return self._client is not None and self._client.is_connected
+
+    def reconnect(self) -> bool:
+        return self._client is not None and self._client.reconnect()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
     def _pop_data(self):
         return self._data_buffer.pop() if self._data_buffer else None
 
-    def get_move(self):
+    def get_move(self, timeout: float = 0.):
         if self._client is None:
             return None
-        return self._client.get_move()
+        return self._client.get_move(timeout)
 
-    def get_game(self):
-        return self._client.get_game()
+    def get_game(self, timeout: float = 0.):
+        return self._client.get_game(timeout)
+
+    def get_packet(self, timeout: float = 0.):
+        return None if self._client is None else self._client.get_packet(timeout)
         # if self.is_busy:
         #     return None
         # if self._data_buffer:
@@ -84,39 +101,42 @@ class Bot(Agent):
     def send_game(self, game_packet):
         self._client.send_game(game_packet)
 
+    def send_sync(self, sync):
+        self._client.send_sync(sync)
+
 
 def gen_moves(blocks, pos, num_rows=NUM_ROWS, num_cols=NUM_COLS):
-    row, col = pos.row, pos.col
-    res = []
-    for r in [-1, 0, 1]:
-        for c in [-1, 0, 1]:
-            if -1 < row + r < num_rows and -1 < col + c < num_cols:
-                if r == 0 and c == 0:
-                    continue
-                if blocks[row + r][col + c] != Block_State.UNFOG:
-                    res.append(Position(row + r, col + c))
-    return res
+    return [p for p in neighbours(num_rows, num_cols)[pos.row][pos.col] if blocks[p.row][p.col] != Block_State.UNFOG]
+
+
+def _update_mobility(game_state: Game_State, pos: Position, delta: int):
+    # keep the state's mobility counters, when it has them, in step with pos turning UNFOG (-1) or FOG (+1)
+    if game_state.mobility is None:
+        return
+    for p in neighbours(game_state.num_rows, game_state.num_cols)[pos.row][pos.col]:
+        game_state.mobility[p.row][p.col] += delta
 
 
 def do_move(game_state: Game_State, move_pos: Position):
     us_pos = game_state.red_king_pos if game_state.side_to_move == RED else game_state.black_king_pos
-    game_state.traces.append(Position(us_pos.row, us_pos.col))
+    game_state.traces.append(us_pos)
+    _update_mobility(game_state, us_pos, -1)
     game_state.blocks[us_pos.row][us_pos.col] = Block_State.UNFOG
     if game_state.side_to_move == RED:
-        game_state.red_king_pos = Position(row=move_pos.row, col=move_pos.col)
+        game_state.red_king_pos = move_pos
     else:
-        game_state.black_king_pos = Position(row=move_pos.row, col=move_pos.col)
+        game_state.black_king_pos = move_pos
     game_state.side_to_move = -game_state.side_to_move
 
 
 def undo_move(game_state: Game_State):
+    trace = game_state.traces.pop()
+    _update_mobility(game_state, trace, 1)
     if game_state.side_to_move == RED:
-        game_state.black_king_pos = Position(game_state.traces[-1].row, game_state.traces[-1].col)
-        game_state.blocks[game_state.black_king_pos.row][game_state.black_king_pos.col] = Block_State.FOG
+        game_state.black_king_pos = trace
     else:
-        game_state.red_king_pos = Position(game_state.traces[-1].row, game_state.traces[-1].col)
-        game_state.blocks[game_state.red_king_pos.row][game_state.red_king_pos.col] = Block_State.FOG
-    game_state.traces.pop()
+        game_state.red_king_pos = trace
+    game_state.blocks[trace.row][trace.col] = Block_State.FOG
     game_state.side_to_move = -game_state.side_to_move
 
 
@@ -125,30 +145,76 @@ def eval_state(game_state: Game_State) -> int:
     king_them_pos = game_state.red_king_pos if game_state.side_to_move == BLACK else game_state.black_king_pos
     if king_us_pos == king_them_pos:
         return LOSS
-    moves_us = gen_moves(game_state.blocks, king_us_pos, game_state.num_rows, game_state.num_cols)
-    moves_them = gen_moves(game_state.blocks, king_them_pos)
-    if len(moves_us) == 0:
+    mobility = game_state.mobility
+    if mobility is not None:
+        moves_us = mobility[king_us_pos.row][king_us_pos.col]
+        moves_them = mobility[king_them_pos.row][king_them_pos.col]
+    else:
+        moves_us = len(gen_moves(game_state.blocks, king_us_pos, game_state.num_rows, game_state.num_cols))
+        moves_them = len(gen_moves(game_state.blocks, king_them_pos))
+    if moves_us == 0:
         return LOSS
-    if len(moves_them) == 0:
+    if moves_them == 0:
         return WIN
-    return len(moves_us) - len(moves_them)
+    return moves_us - moves_them
 
 
 class AI(Agent):
-    def __init__(self, verbose: bool = False, stupidity: str = 'negamax') -> None:
+    def __init__(self, verbose: bool = False, stupidity: str = 'negamax', tt_size: int = TT_SIZE,
+                 time_control: TimeControl = None, max_depth: int = None, workers: int = 1,
+                 background: bool = False, ponder: bool = False, book: str = BOOK_FILE) -> None:
         super().__init__()
         self.type = Agent_Type.AI
         self._thinking = False
         self._move_buffer = []
+        self._board = None
         self.verbose = verbose
+        self.time_control = time_control
+        if max_depth is None:
+            max_depth = AI_DEPTH if time_control is None else NUM_BLOCKS
+        self.max_depth = max_depth
+        # pondering searches the opponent's position in the background engine while it thinks
+        self.ponder = ponder
+        background = background or ponder
+        self._searcher = None
+        self._engine = None
+        self._book = None
+        self._search = self._think
         if stupidity.startswith('random'):
             self._search = self._random
-        elif stupidity.startswith('alpha_beat'):
-            self._search = self._alpha_beta
+            return
+        if book is not None:
+            self._book = book if isinstance(book, OpeningBook) else OpeningBook(book)
+        aspiration = None
+        if stupidity.startswith('minimax'):
+            algorithm = 'minimax'
+        elif stupidity.startswith('alpha_beat') or stupidity.startswith('alpha_beta'):
+            algorithm = 'alpha_beta'
         elif stupidity.startswith('negamax'):
-            self._search = self._negamax
+            algorithm = 'negamax'
+        elif stupidity.startswith('pvs'):
+            algorithm = 'pvs'
+        elif stupidity.startswith('aspiration'):
+            algorithm, aspiration = 'pvs', ASPIRATION_WINDOW
         else:
             raise ValueError("Unknown stupidity: {}".format(stupidity))
+        # a background engine searches in its own process and cannot itself start a process pool
+        if background:
+            self._engine = Engine(algorithm, tt_size, verbose, aspiration)
+        elif workers > 1:
+            self._searcher = ParallelSearcher(algorithm, workers, tt_size, verbose, aspiration)
+        else:
+            self._searcher = Searcher(algorithm, tt_size, verbose, aspiration)
+
+    def close(self):
+        if isinstance(self._searcher, ParallelSearcher):
+            self._searcher.close()
+        if self._engine is not None:
+            self._engine.close()
+
+    @property
+    def tt(self):
+        return None if self._searcher is None else self._searcher.tt
 
     def gen_moves(self, game_state: Game_State):
         king_us_pos = game_state.red_king_pos if game_state.side_to_move == RED else game_state.black_king_pos
@@ -162,10 +228,55 @@ class AI(Agent):
         return self._move_buffer.pop() if self._move_buffer else None
 
     def get_move(self, game_state: Game_State):
+        """
+        With a background engine the first call starts a search and returns None, as do
+        the following calls until the search is over; otherwise the move is searched right away
+        """
+        if self._engine is None:
+            return self.get_move_now(game_state)
         if not self.is_thinking:
-            return self._pop_move()
-        self._make_move(game_state)
-        return None
+            self._board = BitBoard.from_state(game_state)
+            move = self._book_move(self._board)
+            if move is not None:
+                if self.ponder:
+                    self._ponder(move)
+                return move
+            self._engine.start(self._board, self.max_depth, self._budget())
+            self._thinking = True
+        res = self._engine.poll()
+        if res is None:
+            return None
+        self._thinking = False
+        move = self._to_move(self._board, *res)
+        if self.ponder:
+            self._ponder(move)
+        return move
+
+    def _ponder(self, move: Move):
+        """
+        Search the position after move, i.e. every reply of the opponent, until the real reply comes:
+        the next search finds the subtree of that reply in the engine's transposition table
+        """
+        board = self._board.copy()
+        board.do_move(board.pos_to_cell(move.pos))
+        if board.king() < 0 or board.king(RED) == board.king(BLACK) or board.check_lose():
+            return
+        self._engine.ponder(board, self.max_depth)
+
+    @property
+    def is_pondering(self):
+        return self._engine is not None and self._engine.pondering
+
+    def stop(self):
+        """Make a background search return the best move it has found so far"""
+        if self._engine is not None:
+            self._engine.stop()
+
+    def cancel(self):
+        """Drop a background search or ponder, e.g. when the game is reset"""
+        if self._engine is not None:
+            self._engine.cancel()
+        self._thinking = False
 
     def get_move_now(self, game_state: Game_State):
         return self._search(game_state)
@@ -176,157 +287,45 @@ class AI(Agent):
         self._thinking = False
     
     def _random(self, game_state: Game_State) -> Move:
-        moves = self.gen_moves(game_state)
-        if moves is not None:
+        board = BitBoard.from_state(game_state)
+        moves = board.gen_moves()
+        if moves:
             idx = random.randint(0, len(moves) - 1)
-            return Move(game_state.side_to_move, Position(moves[idx].row, moves[idx].col))
+            return Move(game_state.side_to_move, board.cell_to_pos(moves[idx]))
         return None
-    
-    def _negamax(self, game_state: Game_State) -> Move:
-        def _minimax(depth, game_state: Game_State, lo, hi):
-            opt_val = eval_state(game_state)
-            if depth == 0 or opt_val == LOSS or opt_val == WIN:
-                return (opt_val, [])
-            moves = self.gen_moves(game_state)
-            opt_val, opt_move = WIN, []
-            for move in moves:
-                do_move(game_state, move)
-                res, seq = _minimax(depth - 1, game_state, lo, hi)
-                undo_move(game_state)
-                if res <= LOSS:
-                    seq.append(move)
-                    return (WIN, seq)
-                if res <= opt_val:
-                    seq.append(move)
-                    opt_val = res
-                    opt_move = seq
-            return (-opt_val, opt_move)
-        
-        king_them_pos = game_state.red_king_pos if game_state.side_to_move == BLACK else game_state.black_king_pos
-        if king_them_pos is None:
-            opt_val, opt_move = LOSS, None
-            last_pos = game_state.traces[-1]
-            king_thems = gen_moves(game_state.blocks, last_pos)
-            for king_them_pos in king_thems:
-                game_state.king_them_pos = king_them_pos
-                val, move = _minimax(depth=AI_DEPTH, game_state=game_state, lo=LOSS, hi=WIN)
-                game_state.king_them_pos = None
-                if val > opt_val:
-                    opt_val, opt_move = val, move
-        else:
-            opt_val, opt_move = _minimax(depth=AI_DEPTH, game_state=game_state, lo=LOSS, hi=WIN)
-        if opt_move:
-            opt_move = opt_move[::-1]
-            move = Position(opt_move[0].row, opt_move[0].col)
+
+    def _to_move(self, board: BitBoard, opt_val: int, opt_seq: List[int]) -> Move:
+        if opt_seq:
+            opt_seq = opt_seq[::-1]
+            move = board.cell_to_pos(opt_seq[0])
         else:
-            move = gen_moves(game_state.blocks, game_state.king_us_pos)[0]
-            move = Position(move.row, move.col)
-        if opt_val == WIN and self.verbose:
-            print('win')
-            l = min(8, len(opt_move))
-            print(opt_move[:l])
-        if opt_val == LOSS and self.verbose:
-            print('lose')
-            l = min(8, len(opt_move))
-            print(opt_move[:l])
-
-        return Move(game_state.side_to_move, move)
-
-
-    def _alpha_beta(self, game_state: Game_State):
-        def _pvs(game_state: Game_State, depth: int, lo: int, hi: int):
-            if depth <= 0:
-                return (eval_state(game_state), [])
-            moves = gen_moves(game_state.blocks, game_state.king_us_pos)
-            if not len(moves):
-                return (LOSS, [])
-            opt_move = moves.pop()
-            do_move(game_state, opt_move)
-            opt_val, opt_seq = _pvs(game_state, depth - 1, -hi, -lo)
-            opt_val = -opt_val
-            undo_move(game_state)
-            if opt_val > lo:
-                if opt_val >= hi:
-                    opt_seq.append(opt_move)
-                    return (opt_val, opt_seq)
-                lo = opt_val
-
-            for move in moves:
-                do_move(game_state, move)
-                val, seq = _pvs(game_state, depth - 1, -lo - 1, -lo)
-                val = -val
-                if val > lo and val < hi:
-                    val, seq = _pvs(game_state, depth - 1, -hi, -lo)
-                    val *= -1
-                    if val > lo:
-                        lo = val
-                        # opt_move = move
-                undo_move(game_state)
-                if val > opt_val:
-                    opt_seq = seq
-                    opt_move = move
-                    if val >= hi:
-                        opt_seq.append(opt_move)
-                        return (val, opt_seq)
-                    opt_val = val
-            opt_seq.append(opt_move)
-            return (opt_val, opt_seq)
-
-        def _alpha_beta(game_state: Game_State, depth: int, lo: int, hi: int, lohi: int):
-            king_us_pos = game_state.red_king_pos if game_state.side_to_move == RED else game_state.black_king_pos
-            king_them_pos = game_state.red_king_pos if game_state.side_to_move == BLACK else game_state.black_king_pos
-            if king_them_pos == king_us_pos:
-                return (LOSS * lohi, [])
-            if depth == 0:
-                return (lohi * eval_state(game_state), [])
-            moves = self.gen_moves(game_state)
-            if len(moves) == 0:
-                return (LOSS * lohi, [])
-            
-            if lohi > 0:
-                opt_val, opt_seq = LOSS - 1, []
-                for move in moves:
-                    do_move(game_state, move)
-                    val, seq = _alpha_beta(game_state, depth - 1, lo, hi, -lohi)
-                    undo_move(game_state)
-                    if val > opt_val or (val == opt_val and len(seq) < len(opt_seq)):
-                        seq.append(move)
-                        opt_val = val
-                        opt_seq = seq
-                    lo = max(lo, opt_val)
-                    if lo >= hi:
-                        return (opt_val, opt_seq)
-                return (opt_val, opt_seq)
-            else:
-                opt_val, opt_seq = WIN + 1, []
-                for move in moves:
-                    do_move(game_state, move)
-                    val, seq = _alpha_beta(game_state, depth - 1, lo, hi, -lohi)
-                    undo_move(game_state)
-                    if val < opt_val or (val == opt_val and len(seq) < len(opt_seq)):
-                        seq.append(move)
-                        opt_val = val
-                        opt_seq = seq
-                    hi = min(hi, opt_val)
-                    if lo >= hi:
-                        return (opt_val, opt_seq)
-                return (opt_val, opt_seq)
-
-        opt_val, opt_move = _alpha_beta(game_state, AI_DEPTH, LOSS, WIN, 1)
-        # opt_val, opt_move = _pvs(game_state, AI_DEPTH, LOSS, WIN)
-        if opt_move:
-            opt_move = opt_move[::-1]
-            move = Position(opt_move[0].row, opt_move[0].col)
+            move = board.cell_to_pos(board.gen_moves()[0])
+        if opt_val in (WIN, LOSS) and self.verbose:
+            print('win' if opt_val == WIN else 'lose')
+            l = min(8, len(opt_seq))
+            print([board.cell_to_pos(cell) for cell in opt_seq[:l]])
+        return Move(board.side_to_move, move)
+
+    def _think(self, game_state: Game_State) -> Move:
+        board = BitBoard.from_state(game_state)
+        move = self._book_move(board)
+        if move is not None:
+            return move
+        if self._engine is not None:
+            self._engine.start(board, self.max_depth, self._budget())
+            opt_val, opt_seq = self._engine.poll(timeout=None)
         else:
-            move = gen_moves(game_state.blocks, game_state.king_us_pos)[0]
-            move = Position(move.row, move.col)
-        if opt_val == WIN and self.verbose:
-            print('win')
-            l = min(8, len(opt_move))
-            print(opt_move[:l])
-        if opt_val == LOSS and self.verbose:
-            print('lose')
-            l = min(8, len(opt_move))
-            print(opt_move[:l])
-
-        return Move(game_state.side_to_move, move)
+            opt_val, opt_seq = self._searcher.iterate(board, self.max_depth, self._budget())
+        return self._to_move(board, opt_val, opt_seq)
+
+    def _book_move(self, board: BitBoard) -> Move:
+        entry = None if self._book is None else self._book.probe(board)
+        # a key collision or a stale book could suggest anything
+        if entry is None or entry[0] not in board.gen_moves():
+            return None
+        if self.verbose:
+            print('book move, depth {} value {}'.format(entry[1], entry[2]))
+        return Move(board.side_to_move, board.cell_to_pos(entry[0]))
+
+    def _budget(self) -> float:
+        return None if self.time_control is None else self.time_control.move_budget()
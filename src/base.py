@@ -4,25 +4,64 @@
  * You are free to use, modify, re-distribute this code at your own risk
  */
 """
-from typing import List
+from typing import List, Tuple
 from enum import Enum
 from dataclasses import dataclass
+from functools import lru_cache
 
 from .configs import *
-# from .utils import rc_2_pos
+from .utils import rc_2_pos, pos_2_rc, popcount
 
 
-@dataclass
 class Position:
-    row: int
-    col: int
-    def __eq__(self, rhs: object) -> bool:
-        return self.row == rhs.row and self.col == rhs.col
+    """
+    A board cell. Positions are immutable and interned: Position(row, col) always returns the same
+    object, so they compare and hash by identity and boards pass them around without allocating
+    """
+    __slots__ = ('row', 'col')
+    _interned = {}
+
+    def __new__(cls, row: int, col: int) -> 'Position':
+        pos = cls._interned.get((row, col))
+        if pos is None:
+            pos = object.__new__(cls)
+            object.__setattr__(pos, 'row', row)
+            object.__setattr__(pos, 'col', col)
+            cls._interned[(row, col)] = pos
+        return pos
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Position is immutable')
+
+    def __reduce__(self):
+        return Position, (self.row, self.col)
+
+    def __repr__(self) -> str:
+        return 'Position(row={}, col={})'.format(self.row, self.col)
+
 
-@dataclass
 class Move:
-    side: int
-    pos: Position
+    """A side moving its king to pos; immutable and interned like Position"""
+    __slots__ = ('side', 'pos')
+    _interned = {}
+
+    def __new__(cls, side: int, pos: Position) -> 'Move':
+        move = cls._interned.get((side, pos))
+        if move is None:
+            move = object.__new__(cls)
+            object.__setattr__(move, 'side', side)
+            object.__setattr__(move, 'pos', pos)
+            cls._interned[(side, pos)] = move
+        return move
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Move is immutable')
+
+    def __reduce__(self):
+        return Move, (self.side, self.pos)
+
+    def __repr__(self) -> str:
+        return 'Move(side={}, pos={})'.format(self.side, self.pos)
 
 
 class Block_State(Enum):
@@ -54,6 +93,68 @@ class Game_State:
     side_to_move: int
     num_rows: int=NUM_ROWS
     num_cols: int=NUM_COLS
+    # mobility[row][col]: neighbours of the cell that are not UNFOG, see Board; a copy the state's
+    # do_move / undo_move may update without touching the board's
+    mobility: List[List[int]]=None
+
+
+class Snapshot:
+    """
+    Immutable copy of a position: the fog mask and king cells as in BitBoard (-1 for a hidden king),
+    the side to move and the traces as a tuple of cells. Nothing in it aliases a live board, and its
+    hash is computed once, so snapshots can be shared, compared and used as keys freely
+    """
+    __slots__ = ('num_rows', 'num_cols', 'fog', 'red_king', 'black_king', 'side_to_move', 'traces', '_hash')
+
+    def __init__(self, num_rows: int, num_cols: int, fog: int, red_king: int, black_king: int, side_to_move: int,
+                 traces: Tuple[int, ...]=()) -> None:
+        fields = (num_rows, num_cols, fog, red_king, black_king, side_to_move, tuple(traces))
+        for name, value in zip(self.__slots__, fields + (hash(fields),)):
+            object.__setattr__(self, name, value)
+
+    def _fields(self) -> tuple:
+        return (self.num_rows, self.num_cols, self.fog, self.red_king, self.black_king, self.side_to_move, self.traces)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Snapshot is immutable')
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, rhs: object) -> bool:
+        if self is rhs:
+            return True
+        if not isinstance(rhs, Snapshot) or self._hash != rhs._hash:
+            return False
+        return self._fields() == rhs._fields()
+
+    def __reduce__(self):
+        return Snapshot, self._fields()
+
+    def __repr__(self) -> str:
+        return 'Snapshot(num_rows={}, num_cols={}, fog={:#x}, red_king={}, black_king={}, side_to_move={}, traces={})'.format(
+            *self._fields())
+
+
+@lru_cache(maxsize=None)
+def cells(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> Tuple[Tuple[Position, ...], ...]:
+    """cells(...)[row][col]: the Position of every cell of a board"""
+    return tuple(tuple(Position(row, col) for col in range(num_cols)) for row in range(num_rows))
+
+
+@lru_cache(maxsize=None)
+def neighbours(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> Tuple[Tuple[Tuple[Position, ...], ...], ...]:
+    """neighbours(...)[row][col]: the Positions of the (up to 8) cells around a cell"""
+    return tuple(tuple(tuple(Position(row + r, col + c) for r in [-1, 0, 1] for c in [-1, 0, 1]
+                             if (r or c) and -1 < row + r < num_rows and -1 < col + c < num_cols)
+                       for col in range(num_cols)) for row in range(num_rows))
+
+
+@lru_cache(maxsize=None)
+def neighbour_bits(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> Tuple[Tuple[int, ...], ...]:
+    """neighbour_bits(...)[row][col]: the neighbours of a cell as a bitmask over rc_2_pos cell indices"""
+    return tuple(tuple(sum(1 << rc_2_pos(p.row, p.col, num_rows) for p in nbrs) for nbrs in row)
+                 for row in neighbours(num_rows, num_cols))
 
 
 class Board:
@@ -66,49 +167,116 @@ class Board:
         self.red_king_pos = red_king_pos
         self.black_king_pos = black_king_pos
         self.side_to_move = side_to_move
+        self._cells = cells(self.num_rows, self.num_cols)
+        self._neighbours = neighbours(self.num_rows, self.num_cols)
+        # number of neighbours that are not UNFOG, for every cell, and the cells not UNFOG as a bitmask
+        # (see fog_mask), both kept up to date by _unfog and _refog
+        self.mobility = None
+        self.fog = 0
         if blocks is None:
             self.blocks = [[Block] * self.num_cols for _ in range(self.num_rows)]
             self.reset(red_king_pos, black_king_pos)
         else:
             self.blocks = blocks
+            self._count_mobility()
 
-    def reset(self, red_king_pos, black_king_pos) -> None:
+    def reset(self, red_king_pos, black_king_pos, side_to_move: int=None) -> None:
         for row in range(self.num_rows):
             for col in range(self.num_cols):
-                block = Block(Block_State.FOG, Position(row=row, col=col))
-                self.blocks[row][col] = block
+                self.blocks[row][col] = Block(Block_State.FOG, self._cells[row][col])
+        self.traces = []
+        self.mobility = [[len(nbrs) for nbrs in row] for row in self._neighbours]
+        self.fog = (1 << self.num_blocks) - 1
         self.red_king_pos = red_king_pos
         self.black_king_pos = black_king_pos
+        if side_to_move is not None:
+            self.side_to_move = side_to_move
+
+    def _count_mobility(self) -> None:
+        fog, nr = 0, self.num_rows
+        for row in range(nr):
+            for col, block in enumerate(self.blocks[row]):
+                if block.state != Block_State.UNFOG:
+                    fog |= 1 << row + col * nr
+        self.fog = fog
+        self.mobility = [[popcount(fog & bits) for bits in row] for row in neighbour_bits(nr, self.num_cols)]
+
+    def _unfog(self, row: int, col: int) -> None:
+        block = self.blocks[row][col]
+        if block.state == Block_State.UNFOG:
+            return
+        block.state = Block_State.UNFOG
+        self.fog &= ~(1 << rc_2_pos(row, col, self.num_rows))
+        mobility = self.mobility
+        for p in self._neighbours[row][col]:
+            mobility[p.row][p.col] -= 1
+
+    def _refog(self, row: int, col: int) -> None:
+        block = self.blocks[row][col]
+        if block.state != Block_State.UNFOG:
+            return
+        block.state = Block_State.FOG
+        self.fog |= 1 << rc_2_pos(row, col, self.num_rows)
+        mobility = self.mobility
+        for p in self._neighbours[row][col]:
+            mobility[p.row][p.col] += 1
+
+    def fog_mask(self) -> int:
+        """Cells not yet unfogged, as a bitmask over rc_2_pos cell indices"""
+        return self.fog
+
+    def set_fog(self, fog: int) -> None:
+        nr = self.num_rows
+        for row in range(nr):
+            blocks, positions = self.blocks[row], self._cells[row]
+            for col in range(self.num_cols):
+                blocks[col] = Block(Block_State.FOG if fog >> row + col * nr & 1 else Block_State.UNFOG, positions[col])
+        self.fog = fog & (1 << self.num_blocks) - 1
+        self.mobility = [[popcount(self.fog & bits) for bits in row] for row in neighbour_bits(nr, self.num_cols)]
+
+    def _cell(self, cell: int) -> Position:
+        row, col = pos_2_rc(cell, self.num_rows)
+        return self._cells[row][col]
+
+    def snapshot(self) -> Snapshot:
+        nr = self.num_rows
+        red, black = self.red_king_pos, self.black_king_pos
+        return Snapshot(nr, self.num_cols, self.fog, -1 if red is None else rc_2_pos(red.row, red.col, nr),
+                        -1 if black is None else rc_2_pos(black.row, black.col, nr), self.side_to_move,
+                        [rc_2_pos(p.row, p.col, nr) for p in self.traces])
+
+    def restore(self, snapshot: Snapshot) -> None:
+        """Set the board to snapshot, resizing it if needed; the board shares nothing with snapshot"""
+        if (snapshot.num_rows, snapshot.num_cols) != (self.num_rows, self.num_cols):
+            self.num_rows, self.num_cols = snapshot.num_rows, snapshot.num_cols
+            self.num_blocks = self.num_rows * self.num_cols
+            self._cells = cells(self.num_rows, self.num_cols)
+            self._neighbours = neighbours(self.num_rows, self.num_cols)
+            self.blocks = [[Block] * self.num_cols for _ in range(self.num_rows)]
+        self.set_fog(snapshot.fog)
+        self.red_king_pos = None if snapshot.red_king < 0 else self._cell(snapshot.red_king)
+        self.black_king_pos = None if snapshot.black_king < 0 else self._cell(snapshot.black_king)
+        self.side_to_move = snapshot.side_to_move
+        self.traces = [self._cell(cell) for cell in snapshot.traces]
 
     def switch_side(self):
         self.side_to_move = -self.side_to_move
 
+    def _set_king(self, side: int, pos: Position):
+        if side == RED:
+            self.red_king_pos = pos
+        else:
+            self.black_king_pos = pos
+
     def count_move(self, position: Position) -> int:
-        res = 0
-        row, col = position.row, position.col
-        for r in [-1, 0, 1]:
-            for c in [-1, 0, 1]:
-                if -1 < row + r < self.num_rows and -1 < col + c < self.num_cols:
-                    if r == 0 and c == 0:
-                        continue
-                    if self.blocks[row + r][col + c].state != Block_State.UNFOG:
-                        res += 1
-        return res
+        return self.mobility[position.row][position.col]
 
     def gen_moves(self, side_to_move: int = None):
         if side_to_move is None:
             side_to_move = self.side_to_move
-        res = []
         king_pos = self.red_king_pos if side_to_move == RED else self.black_king_pos
-        row, col = king_pos.row, king_pos.col
-        for r in [-1, 0, 1]:
-            for c in [-1, 0, 1]:
-                if -1 < row + r < self.num_rows and -1 < col + c < NUM_COLS:
-                    if r == 0 and c == 0:
-                        continue
-                    if self.blocks[row + r][col + c].state != Block_State.UNFOG:
-                        res.append(Position(row + r, col + c))
-        return res
+        blocks = self.blocks
+        return [p for p in self._neighbours[king_pos.row][king_pos.col] if blocks[p.row][p.col].state != Block_State.UNFOG]
 
     def check_lose(self, side: int) -> bool:
         pos = self.red_king_pos if side == RED else self.black_king_pos
@@ -123,7 +291,8 @@ class Board:
 
     def check_move(self, move: Move) -> Move_Type:
         side, pos = move.side, move.pos
-        if side != self.side_to_move or self.blocks[pos.row][pos.col] == Block_State.UNFOG:
+        if side != self.side_to_move or not self.check_board(pos) or \
+                self.blocks[pos.row][pos.col].state == Block_State.UNFOG:
             return Move_Type.INVALID
         if side == RED:
             king_us_pos, king_them_pos = self.red_king_pos, self.black_king_pos
@@ -140,11 +309,11 @@ class Board:
         m = self.check_move(move)
         if m != Move_Type.INVALID:
             king_pos = self.red_king_pos if move.side == RED else self.black_king_pos
-            self.blocks[king_pos.row][king_pos.col].state = Block_State.UNFOG
-            self.traces.append(Position(king_pos.row, king_pos.col))
+            self._unfog(king_pos.row, king_pos.col)
+            self.traces.append(king_pos)
             if verbose:
                 print('King moves from {} {} to {} {}'.format(king_pos.row, king_pos.col, move.pos.row, move.pos.col))
-            king_pos.row, king_pos.col = move.pos.row, move.pos.col
+            self._set_king(move.side, move.pos)
             self.switch_side()
             if self.check_lose(self.side_to_move):
                 m = Move_Type.WIN
@@ -155,23 +324,30 @@ class Board:
     def force_move(self, move: Move, m: Move_Type, verbose: bool=False):
         king_pos = self.red_king_pos if move.side == RED else self.black_king_pos
         if king_pos is None:
-            self.blocks[move.pos.row][move.pos.col].state = Block_State.UNFOG
-            self.traces.append(Position(move.pos.row, move.pos.col))
+            self._unfog(move.pos.row, move.pos.col)
+            self.traces.append(move.pos)
         else:
-            self.blocks[king_pos.row][king_pos.col].state = Block_State.UNFOG
-            self.traces.append(Position(king_pos.row, king_pos.col))
+            self._unfog(king_pos.row, king_pos.col)
+            self.traces.append(king_pos)
             if verbose:
                 print('King moves from {} {} to {} {}'.format(king_pos.row, king_pos.col, move.pos.row, move.pos.col))
-            king_pos.row, king_pos.col = move.pos.row, move.pos.col
+            self._set_king(move.side, move.pos)
 
         self.switch_side()
         return m
 
+    def undo_move(self) -> None:
+        """Take back the last make_move: the mover's king returns to its last trace, which is fogged again"""
+        self.switch_side()
+        trace = self.traces.pop()
+        self._refog(trace.row, trace.col)
+        self._set_king(self.side_to_move, trace)
+
     def draw(self):
         red_king_pos, black_king_pos = self.red_king_pos, self.black_king_pos
         for row in range(self.num_rows):
             for col in range(self.self.num_cols):
-                pos = Position(row, col)
+                pos = self._cells[row][col]
                 if pos == red_king_pos:
                     print(' K ', end='')
                 elif pos == black_king_pos:
@@ -202,7 +378,8 @@ class Board:
         #                   num_rows=self.num_rows, num_cols=self.num_cols)
     
         return Game_State(blocks=self.blocks, traces=self.traces, red_king_pos=self.red_king_pos, black_king_pos=self.black_king_pos,
-                          num_rows=self.num_rows, num_cols=self.num_cols, side_to_move=self.side_to_move)
+                          num_rows=self.num_rows, num_cols=self.num_cols, side_to_move=self.side_to_move,
+                          mobility=[row[:] for row in self.mobility])
 
     def from_state(self, state: Game_State):
         self.num_rows = state.num_rows
@@ -211,3 +388,6 @@ class Board:
         self.red_king_pos = state.red_king_pos
         self.black_king_pos = state.black_king_pos
         self.side_to_move = state.side_to_move
+        self._cells = cells(self.num_rows, self.num_cols)
+        self._neighbours = neighbours(self.num_rows, self.num_cols)
+        self._count_mobility()
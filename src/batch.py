@@ -0,0 +1,186 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import Iterator, Iterable
+from functools import lru_cache
+
+import numpy as np
+
+from .configs import *
+from .base import Game_State
+from .bitboard import BitBoard, neighbour_masks
+from .record import GameRecord, RecordWriter
+
+
+POLICIES = ('random', 'greedy')
+# a position packed in 12 bytes: fog bitmask over rc_2_pos cells, king cells and side to move
+POSITION_DTYPE = np.dtype([('fog', np.uint64), ('red', np.int16), ('black', np.int16), ('side', np.int8)])
+
+
+@lru_cache(maxsize=None)
+def neighbour_matrix(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> np.ndarray:
+    """nbr[c, d] is True when cell d is a neighbour of cell c"""
+    _, cells = neighbour_masks(num_rows, num_cols)
+    nbr = np.zeros((num_rows * num_cols, num_rows * num_cols), dtype=bool)
+    for cell, nbrs in enumerate(cells):
+        nbr[cell, list(nbrs)] = True
+    nbr.setflags(write=False)
+    return nbr
+
+
+def side_indices(side: np.ndarray) -> np.ndarray:
+    # RED -> 0, BLACK -> 1
+    return (1 - side) >> 1
+
+
+def pack_boards(boards: Iterable[BitBoard]) -> np.ndarray:
+    return np.array([(b.fog, b.kings[0], b.kings[1], b.side_to_move) for b in boards], dtype=POSITION_DTYPE)
+
+
+def pack_states(states: Iterable[Game_State]) -> np.ndarray:
+    return pack_boards(BitBoard.from_state(state) for state in states)
+
+
+def unpack_fog(fog: np.ndarray, num_blocks: int=NUM_BLOCKS) -> np.ndarray:
+    """(positions,) fog bitmasks to a (positions, cells) boolean grid"""
+    return (fog[:, None] >> np.arange(num_blocks, dtype=np.uint64)) & np.uint64(1) == 1
+
+
+def eval_grid(fog: np.ndarray, kings: np.ndarray, side: np.ndarray, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> np.ndarray:
+    """Vectorized eval_state of positions given as a fog grid, (positions, 2) king cells and sides to move"""
+    nbr = neighbour_matrix(num_rows, num_cols)
+    rows = np.arange(len(side))
+    idx = side_indices(side)
+    us, them = kings[rows, idx], kings[rows, 1 - idx]
+    moves_us = (nbr[us] & fog).sum(axis=1)
+    moves_them = (nbr[them] & fog).sum(axis=1)
+    res = (moves_us - moves_them).astype(np.int64)
+    res[moves_them == 0] = WIN
+    res[moves_us == 0] = LOSS
+    res[us == them] = LOSS
+    return res
+
+
+def eval_positions(positions: np.ndarray, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> np.ndarray:
+    """Scores of an array of POSITION_DTYPE positions, the same as eval_state gives one by one"""
+    if num_rows * num_cols > 64:
+        raise ValueError('Fog bitmasks hold at most 64 cells')
+    fog = unpack_fog(positions['fog'], num_rows * num_cols)
+    kings = np.stack([positions['red'], positions['black']], axis=1).astype(np.intp)
+    return eval_grid(fog, kings, positions['side'].astype(np.intp), num_rows, num_cols)
+
+
+class BatchSimulator:
+    """
+    Plays num_games games in lockstep on NumPy arrays: fog is a (games, cells) boolean grid,
+    kings a (games, 2) array of cell indices (RED, BLACK) and side the side to move of every game.
+    Finished games are masked out of every step
+    """
+    def __init__(self, num_games: int, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS,
+                 policy: str='random', seed: int=None, side_to_move: int=RED) -> None:
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy: {}".format(policy))
+        self.num_games = num_games
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_blocks = num_rows * num_cols
+        self.policy = policy
+        self.rng = np.random.default_rng(seed)
+        self.nbr = neighbour_matrix(num_rows, num_cols)
+        self._nbr_count = self.nbr.astype(np.int16)
+        self._side_to_move = side_to_move
+        self.reset()
+
+    def reset(self):
+        n, nb = self.num_games, self.num_blocks
+        red = self.rng.integers(nb, size=n)
+        black = (red + self.rng.integers(1, nb, size=n)) % nb
+        self.kings = np.stack([red, black], axis=1)
+        self.start_kings = self.kings.copy()
+        self.fog = np.ones((n, nb), dtype=bool)
+        self.side = np.full(n, self._side_to_move, dtype=np.int8)
+        self.start_side = self.side.copy()
+        self.winner = np.zeros(n, dtype=np.int8)
+        self.num_moves = np.zeros(n, dtype=np.int16)
+        # at most one move per fogged cell, plus the capture
+        self.moves = np.full((n, nb + 1), -1, dtype=np.int16)
+        self.plies = 0
+
+    @property
+    def active(self) -> np.ndarray:
+        return self.winner == 0
+
+    def _choose(self, games, us, them, legal):
+        n = len(games)
+        if self.policy == 'random':
+            # a uniform pick among the legal cells: the largest random key wins
+            keys = self.rng.random((n, self.num_blocks))
+            return np.argmax(np.where(legal, keys, -1.), axis=1)
+        # greedy: one ply deep, scored like eval_state from the mover's side
+        fog = self.fog[games].copy()
+        fog[np.arange(n), us] = False
+        mob_dest = fog.astype(np.int16) @ self._nbr_count.T
+        mob_them = (self.nbr[them] & fog).sum(axis=1)[:, None]
+        score = (mob_dest - mob_them).astype(np.int64)
+        score = np.where(mob_dest == 0, LOSS, score)
+        score = np.where(mob_them == 0, WIN, score)
+        score[np.arange(n), them] = WIN
+        score = np.where(legal, score + self.rng.random((n, self.num_blocks)), -np.inf)
+        return np.argmax(score, axis=1)
+
+    def step(self) -> int:
+        """Advance every unfinished game by one ply, returns the number of games that moved"""
+        games = np.flatnonzero(self.active)
+        if len(games) == 0:
+            return 0
+        idx = side_indices(self.side[games])
+        us, them = self.kings[games, idx], self.kings[games, 1 - idx]
+        legal = self.nbr[us] & self.fog[games]
+        stuck = ~legal.any(axis=1)
+        self.winner[games[stuck]] = -self.side[games[stuck]]
+        keep = ~stuck
+        games, idx, us, them, legal = games[keep], idx[keep], us[keep], them[keep], legal[keep]
+
+        dest = self._choose(games, us, them, legal)
+        self.fog[games, us] = False
+        self.kings[games, idx] = dest
+        self.moves[games, self.num_moves[games]] = dest
+        self.num_moves[games] += 1
+        side = self.side[games]
+        # a capture, or an opponent left without moves, wins for the mover
+        lost = (dest == them) | ~(self.nbr[them] & self.fog[games]).any(axis=1)
+        self.winner[games[lost]] = side[lost]
+        self.side[games] = -side
+        self.plies += len(games)
+        return len(games)
+
+    def run(self) -> np.ndarray:
+        """Play every game to the end and return the winners"""
+        while self.step():
+            pass
+        return self.winner
+
+    def positions(self) -> np.ndarray:
+        weights = np.uint64(1) << np.arange(self.num_blocks, dtype=np.uint64)
+        res = np.empty(self.num_games, dtype=POSITION_DTYPE)
+        res['fog'] = (self.fog * weights).sum(axis=1, dtype=np.uint64)
+        res['red'], res['black'], res['side'] = self.kings[:, 0], self.kings[:, 1], self.side
+        return res
+
+    def evaluate(self) -> np.ndarray:
+        return eval_grid(self.fog, self.kings, self.side.astype(np.intp), self.num_rows, self.num_cols)
+
+    def records(self) -> Iterator[GameRecord]:
+        for g in range(self.num_games):
+            if self.winner[g] == 0:
+                continue
+            yield GameRecord(int(self.start_kings[g, 0]), int(self.start_kings[g, 1]), int(self.winner[g]),
+                             self.moves[g, :self.num_moves[g]].tolist(), int(self.start_side[g]))
+
+    def write(self, file_name: str, append: bool=False):
+        with RecordWriter(file_name, self.num_rows, self.num_cols, append=append) as writer:
+            for record in self.records():
+                writer.write(record)
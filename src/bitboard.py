@@ -0,0 +1,168 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Tuple
+from functools import lru_cache
+
+from .configs import *
+from .base import Position, Game_State, Board, Block_State, Snapshot, cells
+from .utils import rc_2_pos, pos_2_rc, popcount
+from .ttable import zobrist_keys
+
+
+def side_index(side: int) -> int:
+    # RED -> 0, BLACK -> 1
+    return (1 - side) >> 1
+
+
+@lru_cache(maxsize=None)
+def neighbour_masks(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> Tuple[Tuple[int, ...], Tuple[Tuple[int, ...], ...]]:
+    """
+    Precompute, for every cell, the bitmask of its (up to 8) neighbours
+    and the same neighbours as a tuple of cell indices
+    """
+    masks, cells = [], []
+    for cell in range(num_rows * num_cols):
+        row, col = pos_2_rc(cell, num_rows)
+        mask, nbrs = 0, []
+        for r in [-1, 0, 1]:
+            for c in [-1, 0, 1]:
+                if (r or c) and -1 < row + r < num_rows and -1 < col + c < num_cols:
+                    nbr = rc_2_pos(row + r, col + c, num_rows)
+                    mask |= 1 << nbr
+                    nbrs.append(nbr)
+        masks.append(mask)
+        cells.append(tuple(sorted(nbrs)))
+    return tuple(masks), tuple(cells)
+
+
+class BitBoard:
+    """
+    Compact board used by the search: fog cells are the set bits of one integer,
+    kings are cell indices (see rc_2_pos) and traces are a stack of cell indices.
+    key is the Zobrist hash of fog, kings and side to move, updated incrementally
+    """
+    def __init__(self, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS, fog: int=None,
+                 red_king: int=-1, black_king: int=-1, side_to_move: int=RED, traces: List[int]=None) -> None:
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_blocks = num_rows * num_cols
+        self.full_mask = (1 << self.num_blocks) - 1
+        self.nbr_masks, self.nbr_cells = neighbour_masks(num_rows, num_cols)
+        self.fog = self.full_mask if fog is None else fog
+        self.kings = [red_king, black_king]
+        self.side_to_move = side_to_move
+        self.traces = [] if traces is None else traces
+        self._z_fog, self._z_kings, self._z_side = zobrist_keys(self.num_blocks)
+        self.key = self.hash()
+
+    @classmethod
+    def from_state(cls, state: Game_State):
+        nr, nc = state.num_rows, state.num_cols
+        fog = 0
+        for row in range(nr):
+            for col in range(nc):
+                blk = state.blocks[row][col]
+                blk = blk.state if hasattr(blk, 'state') else blk
+                if blk != Block_State.UNFOG:
+                    fog |= 1 << rc_2_pos(row, col, nr)
+        red_king = -1 if state.red_king_pos is None else rc_2_pos(state.red_king_pos.row, state.red_king_pos.col, nr)
+        black_king = -1 if state.black_king_pos is None else rc_2_pos(state.black_king_pos.row, state.black_king_pos.col, nr)
+        traces = [rc_2_pos(p.row, p.col, nr) for p in state.traces]
+        return cls(nr, nc, fog, red_king, black_king, state.side_to_move, traces)
+
+    @classmethod
+    def from_board(cls, board: Board):
+        return cls.from_snapshot(board.snapshot())
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot):
+        return cls(snapshot.num_rows, snapshot.num_cols, snapshot.fog, snapshot.red_king, snapshot.black_king,
+                   snapshot.side_to_move, list(snapshot.traces))
+
+    def snapshot(self) -> Snapshot:
+        return Snapshot(self.num_rows, self.num_cols, self.fog, self.kings[0], self.kings[1], self.side_to_move, self.traces)
+
+    def copy(self):
+        return BitBoard(self.num_rows, self.num_cols, self.fog, self.kings[0], self.kings[1],
+                        self.side_to_move, list(self.traces))
+
+    def cell_to_pos(self, cell: int) -> Position:
+        row, col = pos_2_rc(cell, self.num_rows)
+        return cells(self.num_rows, self.num_cols)[row][col]
+
+    def pos_to_cell(self, pos: Position) -> int:
+        return rc_2_pos(pos.row, pos.col, self.num_rows)
+
+    def hash(self) -> int:
+        key = self._z_side if self.side_to_move == BLACK else 0
+        for cell in range(self.num_blocks):
+            if self.fog >> cell & 1:
+                key ^= self._z_fog[cell]
+        for idx, king in enumerate(self.kings):
+            if king >= 0:
+                key ^= self._z_kings[idx][king]
+        return key
+
+    def set_king(self, side: int, cell: int) -> None:
+        idx = side_index(side)
+        if self.kings[idx] >= 0:
+            self.key ^= self._z_kings[idx][self.kings[idx]]
+        if cell >= 0:
+            self.key ^= self._z_kings[idx][cell]
+        self.kings[idx] = cell
+
+    def king(self, side: int=None) -> int:
+        if side is None:
+            side = self.side_to_move
+        return self.kings[side_index(side)]
+
+    def count_move(self, cell: int) -> int:
+        return popcount(self.nbr_masks[cell] & self.fog)
+
+    def gen_moves_from(self, cell: int) -> List[int]:
+        fog = self.fog
+        return [c for c in self.nbr_cells[cell] if fog >> c & 1]
+
+    def gen_moves(self, side: int=None) -> List[int]:
+        return self.gen_moves_from(self.king(side))
+
+    def check_lose(self, side: int=None) -> bool:
+        return self.count_move(self.king(side)) == 0
+
+    def do_move(self, cell: int) -> None:
+        idx = side_index(self.side_to_move)
+        us = self.kings[idx]
+        self.traces.append(us)
+        self.fog &= ~(1 << us)
+        self.kings[idx] = cell
+        z_king = self._z_kings[idx]
+        self.key ^= self._z_fog[us] ^ z_king[us] ^ z_king[cell] ^ self._z_side
+        self.side_to_move = -self.side_to_move
+
+    def undo_move(self) -> None:
+        self.side_to_move = -self.side_to_move
+        us = self.traces.pop()
+        idx = side_index(self.side_to_move)
+        self.fog |= 1 << us
+        z_king = self._z_kings[idx]
+        self.key ^= self._z_fog[us] ^ z_king[us] ^ z_king[self.kings[idx]] ^ self._z_side
+        self.kings[idx] = us
+
+    def evaluate(self) -> int:
+        """Same scoring as agent.eval_state, from the side to move's point of view"""
+        idx = side_index(self.side_to_move)
+        us, them = self.kings[idx], self.kings[1 - idx]
+        if us == them:
+            return LOSS
+        fog = self.fog
+        moves_us = popcount(self.nbr_masks[us] & fog)
+        if moves_us == 0:
+            return LOSS
+        moves_them = popcount(self.nbr_masks[them] & fog)
+        if moves_them == 0:
+            return WIN
+        return moves_us - moves_them
@@ -0,0 +1,189 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Tuple
+from time import time
+
+import os
+import mmap
+import struct
+import argparse
+import multiprocessing as mp
+
+from .configs import *
+from .bitboard import BitBoard
+from .search import Searcher
+from .parallel import pack_board
+from .symmetry import symmetry
+
+
+BOOK_FILE = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/book.bin'))
+BOOK_DEPTH = 12
+BOOK_PLIES = 1
+MAGIC = b'KCB'
+VERSION = 2
+# magic, version, num_rows, num_cols, number of entries
+HEADER = struct.Struct('<3sBBBI')
+# canonical key (see Symmetry), best move as a cell of the canonical position, depth searched,
+# value for the side to move; entries are sorted by key
+ENTRY = struct.Struct('<QBBi')
+
+
+class BookFormatError(Exception):
+    pass
+
+
+def is_terminal(board: BitBoard) -> bool:
+    return board.king(RED) == board.king(BLACK) or board.check_lose()
+
+
+def book_positions(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS, plies: int=BOOK_PLIES) -> List[BitBoard]:
+    """
+    Every placement of the two kings with RED to move, and every position up to plies moves later,
+    one position for every set of positions related by a board symmetry
+    """
+    sym = symmetry(num_rows, num_cols)
+    num_blocks = num_rows * num_cols
+    frontier = [BitBoard(num_rows, num_cols, None, red, black, RED)
+                for red in range(num_blocks) for black in range(num_blocks) if red != black]
+    res, seen = [], set()
+    for ply in range(plies + 1):
+        children = []
+        for board in frontier:
+            key, _ = sym.canonical_key(board)
+            if key in seen or is_terminal(board):
+                continue
+            seen.add(key)
+            res.append(board)
+            if ply == plies:
+                continue
+            for cell in board.gen_moves():
+                child = board.copy()
+                child.do_move(cell)
+                children.append(child)
+        frontier = children
+    return res
+
+
+_searcher = None
+
+
+def _init_worker(algorithm: str, tt_size: int):
+    global _searcher
+    _searcher = Searcher(algorithm, tt_size)
+
+
+def _search_position(args) -> Tuple[int, int, int, int]:
+    packed, depth = args
+    board = BitBoard(*packed)
+    val, seq = _searcher.iterate(board, depth)
+    sym = symmetry(board.num_rows, board.num_cols)
+    key, t = sym.canonical_key(board)
+    return key, sym.transform_cell(seq[-1], t), _searcher.depth, val
+
+
+def build_book(file_name: str=BOOK_FILE, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS, depth: int=BOOK_DEPTH,
+               plies: int=BOOK_PLIES, algorithm: str='pvs', tt_size: int=TT_SIZE, workers: int=None,
+               verbose: bool=False) -> int:
+    """Search every book position to depth and write the book; returns the number of entries"""
+    start = time()
+    tasks = [(pack_board(board), depth) for board in book_positions(num_rows, num_cols, plies)]
+    entries = []
+    with mp.Pool(workers or os.cpu_count() or 1, initializer=_init_worker, initargs=(algorithm, tt_size)) as pool:
+        for i, entry in enumerate(pool.imap_unordered(_search_position, tasks, chunksize=4)):
+            entries.append(entry)
+            if verbose and not (i + 1) % 100:
+                print('{}/{} positions, {:.1f}s'.format(i + 1, len(tasks), time() - start))
+    entries.sort()
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, num_rows, num_cols, len(entries)))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    os.replace(tmp_name, file_name)
+    return len(entries)
+
+
+class OpeningBook:
+    """
+    Best moves of opening positions, looked up by canonical key with a binary search over the
+    memory-mapped book file, so one entry serves every symmetric copy of a position.
+    The file is opened on the first probe; a missing file is an empty book
+    """
+    def __init__(self, file_name: str=BOOK_FILE) -> None:
+        self.file_name = file_name
+        self._file = None
+        self._map = None
+        self._loaded = False
+        self.num_rows = self.num_cols = self.size = 0
+        self.hits = self.probes = 0
+
+    def _load(self):
+        self._loaded = True
+        if not os.path.exists(self.file_name) or os.path.getsize(self.file_name) < HEADER.size:
+            return
+        self._file = open(self.file_name, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_rows, self.num_cols, self.size = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or len(self._map) < HEADER.size + self.size * ENTRY.size:
+            self.close()
+            raise BookFormatError('Not an opening book: {}'.format(self.file_name))
+
+    def probe(self, board: BitBoard) -> Tuple[int, int, int]:
+        """(move, depth, value) of board, None when it is not in the book"""
+        if not self._loaded:
+            self._load()
+        if self._map is None or (board.num_rows, board.num_cols) != (self.num_rows, self.num_cols):
+            return None
+        self.probes += 1
+        key, t = symmetry(self.num_rows, self.num_cols).canonical_key(board)
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            mid_key = ENTRY.unpack_from(self._map, HEADER.size + mid * ENTRY.size)[0]
+            if mid_key < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.size:
+            return None
+        entry_key, move, depth, val = ENTRY.unpack_from(self._map, HEADER.size + lo * ENTRY.size)
+        if entry_key != key:
+            return None
+        self.hits += 1
+        return symmetry(self.num_rows, self.num_cols).inverse_cell(move, t), depth, val
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = self._file = None
+        self.size = 0
+
+    def __del__(self):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', type=str, default=BOOK_FILE)
+    parser.add_argument('--rows', type=int, default=NUM_ROWS)
+    parser.add_argument('--cols', type=int, default=NUM_COLS)
+    parser.add_argument('--depth', type=int, default=BOOK_DEPTH)
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES, help='Plies searched beyond the initial placements')
+    parser.add_argument('--algorithm', type=str, default='pvs')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    start = time()
+    size = build_book(args.out, args.rows, args.cols, args.depth, args.plies, args.algorithm,
+                      workers=args.workers, verbose=True)
+    print('{} positions written to {} in {:.1f}s'.format(size, args.out, time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@
 """
 from time import time
 
+MOVES_TO_GO = 12
+
+
 class Clock:
     def __init__(self, total_ticks: int, inc_per_move: int=0) -> None:
         self._total_ticks = total_ticks
@@ -13,9 +16,9 @@ class Clock:
         self._move_ticks = 0
         self._ticks_remained = self._total_ticks
 
-    def tick(self):
-        self._move_ticks += 1
-        self._ticks_remained -= 1
+    def tick(self, ticks: int=1):
+        self._move_ticks += ticks
+        self._ticks_remained -= ticks
 
     def move(self):
         self._ticks_remained += self._inc_per_move
@@ -29,6 +32,11 @@ class Clock:
     def total_time(self):
         return self._ticks_remained
 
+    def move_budget(self, moves_to_go: int=MOVES_TO_GO) -> float:
+        """Ticks to spend on the next move: an even share of the remaining time plus most of the increment"""
+        budget = self._ticks_remained / max(moves_to_go, 1) + 0.75 * self._inc_per_move
+        return max(0., min(budget, 0.5 * self._ticks_remained))
+
 
 class TimeControl:
     def __init__(self, total_time: int, inc_per_move: int=0, num_players: int=2, sec_to_ticks: int=60) -> None:
@@ -44,6 +52,17 @@ class TimeControl:
             self._clocks[self._current_index].tick()
             self.update_time()
 
+    def sync(self):
+        """Charge the side to move with all the time elapsed since the last update, not just one tick"""
+        ticks = int((time() - self._last_time) * self._sec_to_ticks)
+        if ticks > 0:
+            self._clocks[self._current_index].tick(ticks)
+            self._last_time += ticks / self._sec_to_ticks
+
+    @property
+    def seconds_left(self) -> float:
+        return self.current_clock.total_time / self._sec_to_ticks
+
     def move(self):
         self._clocks[self._current_index].move()
         self._current_index = (self._current_index + 1) % self.num_players
@@ -55,6 +74,14 @@ class TimeControl:
             clock.reset()
         self.update_time()
 
+    @property
+    def current_clock(self) -> Clock:
+        return self._clocks[self._current_index]
+
+    def move_budget(self, moves_to_go: int=MOVES_TO_GO) -> float:
+        """Seconds the side to move may spend on its next move"""
+        return self.current_clock.move_budget(moves_to_go) / self._sec_to_ticks
+
     @property
     def is_time_over(self):
         return self._clocks[self._current_index].total_time < 0
@@ -15,7 +15,11 @@ SCR_WIDTH, SCR_HEIGHT = 600, 600
 FOG_COLOR = 'Brown'
 UNFOG_COLOR = 'Blue'
 SEC_TO_TICKS, GAME_TIME = 60, 3600
+FPS = 60
 AI_DEPTH = 10
+TT_SIZE = 1 << 18
+ASPIRATION_WINDOW = 2
+LOSS, WIN = -1000_000, 1000_000
 
 class Game_Mode(Enum):
     MAN_VS_MAN = 0
@@ -0,0 +1,139 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Tuple
+
+import multiprocessing as mp
+
+from .configs import *
+from .bitboard import BitBoard
+from .search import Searcher
+from .parallel import pack_board
+from .ordering import HEURISTICS
+
+
+CLOSE_TIMEOUT = 1.
+
+
+def _engine_main(conn, stop_event, latest, algorithm: str, tt_size: int, verbose: bool, aspiration: int, ordering):
+    searcher = Searcher(algorithm, tt_size, verbose, aspiration, ordering)
+    searcher.stop_event = stop_event
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        search_id, packed, max_depth, budget = msg
+        # searches started or cancelled since this one was sent are skipped. A stop meant for an earlier
+        # search may still be set; once it is cleared, a newer search can only come with a new stop
+        if search_id != latest.value:
+            continue
+        stop_event.clear()
+        if search_id != latest.value:
+            continue
+        val, seq = searcher.iterate(BitBoard(*packed), max_depth, budget)
+        conn.send((search_id, val, seq))
+
+
+class Engine:
+    """
+    A Searcher running in a worker process, so that the caller never waits for a search:
+    start() hands over a position, poll() returns (value, seq) once the search is over,
+    stop() asks for the best result found so far and cancel() drops the search.
+    ponder() searches a position only for the sake of the worker's transposition table,
+    which the next search starts with
+    """
+    def __init__(self, algorithm: str='negamax', tt_size: int=TT_SIZE, verbose: bool=False,
+                 aspiration: int=None, ordering=HEURISTICS) -> None:
+        self._args = (algorithm, tt_size, verbose, aspiration, ordering)
+        self._process = None
+        self._conn = None
+        self._stop_event = None
+        # id of the newest search, the only one the worker may run
+        self._latest = None
+        self._search_id = 0
+        self._pending = None
+        self._pondering = False
+
+    @property
+    def searching(self) -> bool:
+        return self._pending is not None
+
+    @property
+    def pondering(self) -> bool:
+        return self._pondering
+
+    def _ensure_process(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        self._conn, child_conn = mp.Pipe()
+        self._stop_event = mp.Event()
+        self._latest = mp.RawValue('q', self._search_id)
+        self._process = mp.Process(target=_engine_main, args=(child_conn, self._stop_event, self._latest) + self._args,
+                                   daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._pending = None
+        self._pondering = False
+
+    def start(self, board: BitBoard, max_depth: int=AI_DEPTH, budget: float=None):
+        self.cancel()
+        self._ensure_process()
+        self._search_id += 1
+        self._latest.value = self._pending = self._search_id
+        self._conn.send((self._search_id, pack_board(board), max_depth, budget))
+
+    def ponder(self, board: BitBoard, max_depth: int=AI_DEPTH):
+        """Search board, with no time limit and no result wanted, until the next start or cancel"""
+        self.start(board, max_depth)
+        self._pending = None
+        self._pondering = True
+
+    def poll(self, timeout: float=0.) -> Tuple[int, List[int]]:
+        """(value, seq) of the search in progress once it is over, None until then; timeout None waits for it"""
+        if self._conn is None:
+            return None
+        while self._pending is not None and self._conn.poll(timeout):
+            search_id, val, seq = self._conn.recv()
+            # results of cancelled searches are dropped
+            if search_id == self._pending:
+                self._pending = None
+                return val, seq
+        return None
+
+    def stop(self):
+        if self.searching:
+            self._stop_event.set()
+
+    def cancel(self):
+        if self.searching or self.pondering:
+            self._search_id += 1
+            self._latest.value = self._search_id
+            self._stop_event.set()
+            self._pending = None
+            self._pondering = False
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._stop_event.set()
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(CLOSE_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._conn.close()
+        self._process = self._conn = None
+        self._pending = None
+        self._pondering = False
+
+    def __del__(self):
+        self.close()
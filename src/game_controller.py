@@ -14,6 +14,10 @@ from .agent import *
 from .network import *
 from .utils import threaded
 
+
+# seconds left on the clock below which a running search is told to move now
+LOW_TIME = 1.
+
 class KingGameController:
     def __init__(self, game_view, game_mode, game_type, network, host=HOST, port=PORT) -> None:        
         self.network = Game_Network(network)
@@ -26,9 +30,13 @@ class KingGameController:
         if self.game_mode == Game_Mode.AI_VS_AI:
             self.side = KIBITZ
         self.game_view = game_view
+        # a client has no game until the server sends one
+        self._waiting_game = self.network == Game_Network.client
+        self._next_reconnect = 0.
 
         if self.network != Game_Network.client:
             self.game = KingGameModel(game_mode=game_mode, game_type=game_type)         
+            self._new_history()
 
         self.init_game()
 
@@ -40,14 +48,32 @@ class KingGameController:
         num_rows, num_cols = gp.board_size
         self.game_type, self.game_mode, self.side = gp.game_type, gp.game_mode, gp.side
         red_king_pos, black_king_pos = gp.red_king_pos, gp.black_king_pos
-        blocks = gp.blocks
-        return KingGameModel(board=Board(num_rows, num_cols, red_king_pos, black_king_pos, RED, blocks),
-                             game_mode=self.game_mode, game_type=self.game_type)
+        board = Board(num_rows, num_cols, red_king_pos, black_king_pos, gp.side_to_move)
+        board.set_fog(gp.fog)
+        return KingGameModel(board=board, game_mode=self.game_mode, game_type=self.game_type)
 
     def to_packet(self):
         return GamePacket(-self.side, self.game_mode, self.game_type,
-                          self.board.red_king_pos, self.board.black_king_pos, self.board.blocks,
-                          (self.board.num_rows, self.board.num_cols))
+                          self.board.red_king_pos, self.board.black_king_pos, self.board.fog_mask(),
+                          (self.board.num_rows, self.board.num_cols), self.board.side_to_move)
+
+    def _new_history(self):
+        sync = sync_packet(self.board)
+        self._first_ply, self._keys, self._move_log = sync.ply, [sync.key], []
+
+    def _record(self, move: Move):
+        self._move_log.append(move)
+        self._keys.append(sync_packet(self.board).key)
+
+    def position(self, request: bool=False) -> SyncPacket:
+        if self._waiting_game:
+            return SyncPacket(0, 0, request)
+        return SyncPacket(self._first_ply + len(self._keys) - 1, self._keys[-1], request)
+
+    def _known(self, sync: SyncPacket) -> bool:
+        """Whether this side went through the position of sync in the current game"""
+        i = sync.ply - self._first_ply
+        return not self._waiting_game and 0 <= i < len(self._keys) and self._keys[i] == sync.key
 
     def set_move(self, move):
         self.move_buffer = move
@@ -58,11 +84,11 @@ class KingGameController:
                 self.red_player = Human(self.game_view)
                 self.black_player = Human(self.game_view)
             elif self.game_mode == Game_Mode.AI_VS_AI:
-                self.red_player = AI()
-                self.black_player = AI()
+                self.red_player = AI(time_control=self.time_control, background=True)
+                self.black_player = AI(time_control=self.time_control, background=True)
             else:
                 self.red_player = Human(self.game_view)
-                self.black_player = AI()
+                self.black_player = AI(time_control=self.time_control, ponder=True)
         elif self.network == Game_Network.server:
             self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server.bind((self.host, self.port))
@@ -82,26 +108,92 @@ class KingGameController:
 
     @threaded
     def connect_as_server(self):
-        print('Waiting client to connect')
-        c_sock, _ = self.server.accept()
-        print('Client has connected')
-        self.black_player._client = GameClient(sock=c_sock)
-        self.black_player.send_game(self.to_packet())
+        # a client that reconnects replaces the old connection, its first sync packet says what it is missing
+        while True:
+            print('Waiting client to connect')
+            c_sock, _ = self.server.accept()
+            print('Client has connected')
+            old_client = self.black_player._client
+            self.black_player._client = GameClient(sock=c_sock, ordered=True)
+            if old_client is not None:
+                old_client.close()
 
     # @threaded
     def connect_as_client(self):
         c_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         c_sock.connect((self.host, self.port))
         print('Connected to server')
-        self.red_player._client = GameClient(sock=c_sock)
+        self.red_player._client = GameClient(sock=c_sock, host=self.host, port=self.port, ordered=True)
+        self.red_player.send_sync(self.position(request=True))
         self.get_game(self.red_player)
 
     def get_game(self, bot):
-        while True:
-            gp = bot.get_game()
-            if gp is not None and isinstance(gp, GamePacket):
-                self.game = self.from_packet(gp)
-                break
+        """Wait for the first game from the server"""
+        while self._waiting_game:
+            packet = bot.get_packet(timeout=CONNECT_TIMEOUT)
+            if isinstance(packet, GamePacket):
+                self.on_game(packet)
+            elif packet is None and not bot.is_connected:
+                raise ConnectionError('The server has closed the connection')
+
+    @property
+    def peer(self):
+        """The Bot standing for the other end of a network game"""
+        return self.red_player if self.side == BLACK else self.black_player
+
+    def sync_peer(self):
+        """Apply what the other end has sent, in order, and reconnect a client that lost the server"""
+        peer = self.peer
+        packet = peer.get_packet()
+        while packet is not None:
+            if isinstance(packet, GamePacket):
+                self.on_game(packet)
+            elif isinstance(packet, MovePacket):
+                self.on_move(packet.move)
+            elif isinstance(packet, SyncPacket):
+                self.on_sync(packet)
+            packet = peer.get_packet()
+        if not peer.is_connected and self.network == Game_Network.client and time.time() >= self._next_reconnect:
+            self._next_reconnect = time.time() + RECONNECT_INTERVAL
+            if peer.reconnect():
+                print('Reconnected to server')
+                peer.send_sync(self.position(request=True))
+
+    def on_game(self, gp: GamePacket):
+        if self.network != Game_Network.client:
+            return
+        self.game = self.from_packet(gp)
+        self._waiting_game = False
+        self._new_history()
+
+    def on_move(self, move: Move):
+        if self._waiting_game:
+            return
+        if move.side != -self.side or self.make_move(move) == Move_Type.INVALID:
+            self.resync()
+
+    def on_sync(self, sync: SyncPacket):
+        if self._waiting_game:
+            return
+        if self.network == Game_Network.server and not sync.request and sync.ply > self.position().ply:
+            # the client's last game, or a move the server refused and has already answered
+            return
+        if not self._known(sync):
+            self.resync()
+        elif sync.request and self.network == Game_Network.server:
+            # the client went through a position of this game: replay the moves it has missed
+            missed = self._move_log[sync.ply - self._first_ply:]
+            for move in missed:
+                self.peer.send_move(move)
+            if missed:
+                self.peer.send_sync(self.position())
+
+    def resync(self):
+        """The server sends the whole position, a client asks for it"""
+        if self.network == Game_Network.server:
+            self.peer.send_game(self.to_packet())
+        else:
+            self.peer.send_sync(self.position(request=True))
 
     @property
     def player(self):
@@ -113,11 +205,17 @@ class KingGameController:
         self.reset()
 
     def play(self):
+        if self.network != Game_Network.offline:
+            self.sync_peer()
+            if self._waiting_game:
+                return
         self.time_control.tick()
         if self.time_control.is_time_over:
             win_side = -self.side_to_move
             self.game_over(win_side=win_side)
             return
+        if self.player.type == Agent_Type.AI and self.player.is_thinking and self.time_control.seconds_left < LOW_TIME:
+            self.player.stop()
         move = self.get_move()
         if isinstance(move, Move):
             self.make_move(move)
@@ -131,33 +229,50 @@ class KingGameController:
     def side_to_move(self):
         return self.game.side_to_move
 
-    def make_move(self, move: Move):
+    def make_move(self, move: Move) -> Move_Type:
         if move is None or self.board.check_move(move) == Move_Type.INVALID:
-            return
+            return Move_Type.INVALID
         m = self.game.make_move(move)
         if m != Move_Type.INVALID:
             self.time_control.move()
-            self.broad_cast(move)
+            if self.network != Game_Network.offline:
+                self._record(move)
+            # the last move of a game is followed by a new game, not by a sync packet
+            self.broad_cast(move, sync=m != Move_Type.WIN)
         if m == Move_Type.WIN:
             win_side = -self.side_to_move
             self.game_over(win_side=win_side)
+        return m
     
     def get_move(self):
-        return None if self.player is None else self.player.get_move()
+        # the other end's moves are applied by sync_peer, in order with its sync packets
+        if self.player is None or self.player.type == Agent_Type.BOT:
+            return None
+        if self.player.type == Agent_Type.AI:
+            # returns None while the search runs in the background
+            return self.player.get_move(self.game.get_state())
+        return self.player.get_move()
 
-    def broad_cast(self, move):
-        if self.player.type == Agent_Type.BOT:
+    def broad_cast(self, move, sync: bool=True):
+        # moves made while the other end is away are replayed when it comes back
+        if self.player.type == Agent_Type.BOT and self.player.is_connected:
             self.player.send_move(move)
+            if sync:
+                self.player.send_sync(self.position())
 
     def reset(self):
         self.game_view.reset()
         self.time_control.reset()
+        for player in (self.red_player, self.black_player):
+            if player.type == Agent_Type.AI:
+                player.cancel()
         if self.network != Game_Network.client:
             self.game.reset()
             if self.network == Game_Network.server:
-                bot = self.red_player if self.side == BLACK else self.black_player
-                bot.send_game(self.to_packet())
+                self._new_history()
+                if self.peer.is_connected:
+                    self.peer.send_game(self.to_packet())
         else:
-            bot = self.red_player if self.side == BLACK else self.black_player
-            self.get_game(bot)
+            # the next game comes with the next packets, play() waits for it without blocking
+            self._waiting_game = True
         self.play()
\ No newline at end of file
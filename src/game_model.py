@@ -32,7 +32,7 @@ class KingGameModel:
 
     def reset(self, side_to_move: int=RED) -> None:
         red_king_pos, black_king_pos = self.random_kings()
-        self.board.reset(red_king_pos=red_king_pos, black_king_pos=black_king_pos)
+        self.board.reset(red_king_pos=red_king_pos, black_king_pos=black_king_pos, side_to_move=side_to_move)
     
     @staticmethod
     def random_kings():
@@ -82,5 +82,11 @@ class KingGameModel:
     def from_state(self, state: Game_State):
         self.board.from_state(state)
 
+    def snapshot(self) -> Snapshot:
+        return self.board.snapshot()
+
+    def restore(self, snapshot: Snapshot):
+        self.board.restore(snapshot)
+
     def check_move(self, move: Move):
         return self.board.check_move(move)
\ No newline at end of file
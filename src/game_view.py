@@ -27,6 +27,10 @@ class KingGameView:
 
         self.cursor = Position(0, 0)
         self._move_buffer = []
+        self.clock = pygame.time.Clock()
+        # one surface per tile color, and the color each cell was last drawn with
+        self._tiles = {}
+        self._drawn = None
 
         self.game_controller = KingGameController(self, game_mode, game_type, network)
 
@@ -35,6 +39,7 @@ class KingGameView:
             self.handle_input()
             self.render()
             self.game_controller.play()
+            self.clock.tick(FPS)
 
     def handle_input(self):
         game = self.game_controller.game
@@ -43,41 +48,65 @@ class KingGameView:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.quit()
+            elif event.type == pygame.VIDEOEXPOSE:
+                self._drawn = None
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_UP:
-                    self.cursor.row = (self.cursor.row + num_rows - 1) % num_rows
+                    self.cursor = Position((self.cursor.row + num_rows - 1) % num_rows, self.cursor.col)
                 elif event.key == pygame.K_DOWN:
-                    self.cursor.row = (self.cursor.row + 1) % num_rows
+                    self.cursor = Position((self.cursor.row + 1) % num_rows, self.cursor.col)
                 elif event.key == pygame.K_LEFT:
-                    self.cursor.col = (self.cursor.col + num_cols - 1) % num_cols
+                    self.cursor = Position(self.cursor.row, (self.cursor.col + num_cols - 1) % num_cols)
                 elif event.key == pygame.K_RIGHT:
-                    self.cursor.col = (self.cursor.col + 1) % num_cols
+                    self.cursor = Position(self.cursor.row, (self.cursor.col + 1) % num_cols)
                 elif event.key == pygame.K_RETURN and human_turn:
                     move = Move(side=game.side_to_move, pos=self.cursor)
                     if game.check_move(move) != Move_Type.INVALID:
                         self._move_buffer.append(move)
 
-    def render(self):
+    def _tile(self, color, size):
+        key = (color, size)
+        if key not in self._tiles:
+            tile = pygame.Surface(size)
+            tile.fill(color)
+            self._tiles[key] = tile
+        return self._tiles[key]
+
+    def cell_colors(self):
         game = self.game_controller.game
         blocks, game_type = game.board.blocks, game.game_type
         num_rows, num_cols = game.board.num_rows, game.board.num_cols
-        wsz, hsz = self.scr_height // num_cols, self.scr_width // num_rows
         rk, bk = game.board.red_king_pos, game.board.black_king_pos
 
-        for r in range(num_rows):
-            for c in range(num_cols):
-                color = (50, 100, 100) if blocks[r][c].state == Block_State.UNFOG else (125, 125, 125)
-                pygame.draw.rect(self.screen, color, (c * wsz, r * hsz, hsz, wsz))
+        colors = [[(50, 100, 100) if blocks[r][c].state == Block_State.UNFOG else (125, 125, 125)
+                   for c in range(num_cols)] for r in range(num_rows)]
         if game_type == Game_Type.VISIBLE:
-            pygame.draw.rect(self.screen, (255, 10, 20), (rk.col * wsz, rk.row * hsz, hsz, wsz))
-            pygame.draw.rect(self.screen, (5, 5, 5), (bk.col * wsz, bk.row * hsz, hsz, wsz))
+            colors[rk.row][rk.col] = (255, 10, 20)
+            colors[bk.row][bk.col] = (5, 5, 5)
         elif self.side == RED:
-            pygame.draw.rect(self.screen, (255, 10, 20), (rk.col * wsz, rk.row * hsz, hsz, wsz))
+            colors[rk.row][rk.col] = (255, 10, 20)
         else:
-            pygame.draw.rect(self.screen, (5, 5, 5), (bk.col * wsz, bk.row * hsz, hsz, wsz))
+            colors[bk.row][bk.col] = (5, 5, 5)
         # if self.current_player.type == Agent_Type.HUMAN:
-        pygame.draw.rect(self.screen, (255, 192, 203), (self.cursor.col * wsz, self.cursor.row * hsz, hsz, wsz))
-        pygame.display.update()
+        colors[self.cursor.row][self.cursor.col] = (255, 192, 203)
+        return colors
+
+    def render(self):
+        """Blit the cells whose color changed since the last frame and update only their rects"""
+        colors = self.cell_colors()
+        num_rows, num_cols = len(colors), len(colors[0])
+        wsz, hsz = self.scr_height // num_cols, self.scr_width // num_rows
+        if self._drawn is None or len(self._drawn) != num_rows or len(self._drawn[0]) != num_cols:
+            self._drawn = [[None] * num_cols for _ in range(num_rows)]
+
+        rects = []
+        for r in range(num_rows):
+            for c in range(num_cols):
+                if colors[r][c] != self._drawn[r][c]:
+                    rects.append(self.screen.blit(self._tile(colors[r][c], (hsz, wsz)), (c * wsz, r * hsz)))
+                    self._drawn[r][c] = colors[r][c]
+        if rects:
+            pygame.display.update(rects)
 
     @property
     def side(self):
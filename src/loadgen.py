@@ -0,0 +1,191 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List
+from dataclasses import dataclass, field
+from threading import Thread
+from time import time
+
+import os
+import argparse
+import asyncio
+import random
+import socket
+import multiprocessing as mp
+
+from .configs import *
+from .base import Move
+from .bitboard import BitBoard
+from .agent import Bot
+from .network import GameClient, GamePacket, HOST
+from .server import GameServer
+from .utils import rc_2_pos
+
+
+POLL_TIME = 0.05
+DROP_TIMEOUT = 5.
+
+
+@dataclass
+class PlayerStats:
+    sent: int = 0
+    received: int = 0
+    games: int = 0
+    resyncs: int = 0
+    invalid: int = 0
+    dropped: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+
+def board_from_packet(gp: GamePacket) -> BitBoard:
+    nr, nc = gp.board_size
+    return BitBoard(nr, nc, gp.fog, rc_2_pos(gp.red_king_pos.row, gp.red_king_pos.col, nr),
+                    rc_2_pos(gp.black_king_pos.row, gp.black_king_pos.col, nr), gp.side_to_move)
+
+
+def game_ended(board: BitBoard) -> bool:
+    return board.king(RED) == board.king(BLACK) or board.check_lose()
+
+
+def play(bot: Bot, deadline: float, stats: PlayerStats, seed: int=None):
+    """
+    Random mover over one connection. The round trip of a move is measured from sending it
+    to receiving the opponent's reply, so it includes two server hops
+    """
+    rng = random.Random(seed)
+    board, side, sent_at, waiting_game = None, KIBITZ, None, True
+    while time() < deadline and bot.is_connected:
+        gp = bot.get_game(timeout=POLL_TIME if waiting_game else 0.)
+        if gp is not None:
+            if not waiting_game:
+                stats.resyncs += 1
+            board, side, sent_at, waiting_game = board_from_packet(gp), gp.side, None, False
+            stats.games += 1
+            continue
+        if waiting_game:
+            continue
+        if board.side_to_move == side:
+            cell = rng.choice(board.gen_moves())
+            bot.send_move(Move(side, board.cell_to_pos(cell)))
+            sent_at = time()
+            stats.sent += 1
+            board.do_move(cell)
+            waiting_game = game_ended(board)
+            continue
+        move = bot.get_move(timeout=POLL_TIME)
+        if move is None:
+            if sent_at is not None and time() - sent_at > DROP_TIMEOUT:
+                stats.dropped += 1
+                sent_at = None
+            continue
+        stats.received += 1
+        if sent_at is not None:
+            stats.latencies.append(time() - sent_at)
+            sent_at = None
+        cell = board.pos_to_cell(move.pos)
+        if move.side != -side or cell not in board.gen_moves():
+            stats.invalid += 1
+            waiting_game = True
+            continue
+        board.do_move(cell)
+        waiting_game = game_ended(board)
+
+
+def process_usage(pid: int):
+    """(cpu seconds, resident bytes) of a process, read from /proc; None where unavailable"""
+    cpu, rss = None, None
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return cpu, rss
+
+
+def _run_server(ports: mp.Queue, max_clients: int):
+    async def _serve():
+        server = GameServer(port=0, max_clients=max_clients)
+        await server.start()
+        ports.put(server.port)
+        await server.serve_forever()
+    try:
+        asyncio.run(_serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_load(num_players: int=100, duration: float=10., host: str=HOST, port: int=None, seed: int=0) -> dict:
+    """
+    Play num_players random movers against a game server for duration seconds. Without a port,
+    a GameServer is started in a child process so that its CPU and memory can be measured
+    """
+    server = None
+    if port is None:
+        ports = mp.Queue()
+        server = mp.Process(target=_run_server, args=(ports, num_players + 1), daemon=True)
+        server.start()
+        port = ports.get(timeout=10)
+    cpu_0, _ = process_usage(server.pid) if server is not None else (None, None)
+
+    stats = [PlayerStats() for _ in range(num_players)]
+    bots = []
+    for _ in range(num_players):
+        client = GameClient(socket.create_connection((host, port)))
+        client.join(RED)
+        bots.append(Bot(client))
+    start = time()
+    deadline = start + duration
+    threads = [Thread(target=play, args=(bot, deadline, st, seed + i), daemon=True) for i, (bot, st) in enumerate(zip(bots, stats))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - start
+
+    cpu_1, rss = process_usage(server.pid) if server is not None else (None, None)
+    for bot in bots:
+        bot.close()
+    if server is not None:
+        server.terminate()
+        server.join()
+
+    latencies = [lat for st in stats for lat in st.latencies]
+    moves = sum(st.sent for st in stats)
+    return dict(players=num_players, seconds=elapsed, moves=moves, moves_per_sec=moves / elapsed,
+                games=sum(st.games for st in stats) // 2, p50_ms=1000 * percentile(latencies, 0.5),
+                p99_ms=1000 * percentile(latencies, 0.99), dropped=sum(st.dropped for st in stats),
+                invalid=sum(st.invalid for st in stats), resyncs=sum(st.resyncs for st in stats),
+                server_cpu=None if cpu_1 is None else (cpu_1 - cpu_0) / elapsed,
+                server_rss_mb=None if rss is None else rss / (1 << 20))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.)
+    parser.add_argument('--host', type=str, default=HOST)
+    parser.add_argument('--port', type=int, default=None, help='Load an already running server instead of starting one')
+    args = parser.parse_args()
+
+    report = run_load(args.players, args.duration, args.host, args.port)
+    for key, value in report.items():
+        print('{:>14}: {}'.format(key, '{:.3f}'.format(value) if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
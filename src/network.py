@@ -4,38 +4,23 @@
  * You are free to use, modify, re-distribute this code at your own risk
  */
 """
-from typing import List, Tuple
 from dataclasses import dataclass
+from threading import Thread
 
+import queue
 import socket
-import pickle
 
 from .base import *
-from .utils import threaded
+from .protocol import *
 
 
 HOST = '127.0.0.1'
 PORT = 12345
-MAX_CLIENTS = 5
+MAX_CLIENTS = 10_000
 MOVE_BUFF_SIZE = 1024
 GAME_BUFF_SIZE = 8192
-
-
-@dataclass
-class MovePacket:
-    move: Move
-    id: str=''
-
-
-@dataclass
-class GamePacket:
-    side: int
-    game_mode: Game_Mode
-    game_type: Game_Type
-    red_king_pos: Position
-    black_king_pos: Position
-    blocks: List[Block]
-    board_size: Tuple[int, int]
+CONNECT_TIMEOUT = 1.
+RECONNECT_INTERVAL = 1.
 
 
 @dataclass
@@ -47,53 +32,125 @@ class ClientAddress:
 
 
 class GameClient:
-    def __init__(self, sock: socket=None, id: str='', host=HOST, port=PORT) -> None:
+    """
+    Framed packet connection with one long-lived reader thread, which sorts incoming packets
+    into a move and a game queue, and one writer thread, which sends packets in order.
+    An ordered client keeps every packet in the move queue, in arrival order, for get_packet
+    """
+    def __init__(self, sock: socket=None, id: str='', host=HOST, port=PORT, ordered: bool=False) -> None:
         self.id = id
+        self.host = host
+        self.port = port
+        self.ordered = ordered
+        self.sock = None
+        self.error = None
+        self._decoder = FrameDecoder()
+        self._moves = queue.Queue()
+        self._games = queue.Queue()
+        self._outbox = queue.Queue()
+        self._reader = None
+        self._writer = None
+        if sock is not None:
+            self.start(sock)
+
+    def start(self, sock: socket):
         self.sock = sock
-        self._data_buffer = []
-        self._busy = False
+        self.error = None
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = Thread(target=self._read_loop, args=(sock, self._outbox), daemon=True)
+        self._writer = Thread(target=self._write_loop, args=(sock, self._outbox), daemon=True)
+        self._reader.start()
+        self._writer.start()
 
     @property
-    def is_busy(self):
-        return self._busy
+    def is_connected(self):
+        return self._reader is not None and self._reader.is_alive()
+
+    def _read_loop(self, sock: socket, outbox: queue.Queue):
+        try:
+            while True:
+                data = sock.recv(GAME_BUFF_SIZE)
+                if not data:
+                    break
+                for packet in self._decoder.feed(data):
+                    game = isinstance(packet, GamePacket) and not self.ordered
+                    (self._games if game else self._moves).put(packet)
+        except (OSError, ProtocolError) as e:
+            self.error = e
+        finally:
+            outbox.put(None)
+
+    def _write_loop(self, sock: socket, outbox: queue.Queue):
+        while True:
+            data = outbox.get()
+            if data is None:
+                break
+            try:
+                sock.sendall(data)
+            except OSError as e:
+                self.error = e
+                break
 
-    def _pop_data(self):
-        return self._data_buffer.pop() if len(self._data_buffer) else None
+    def reconnect(self, timeout: float=CONNECT_TIMEOUT) -> bool:
+        """Open a new connection to host:port after the last one dropped"""
+        if self.is_connected:
+            return True
+        self.close()
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        except OSError as e:
+            self.error = e
+            return False
+        sock.settimeout(None)
+        # a new outbox, so that nothing queued for the dead connection is sent on the new one
+        self._outbox = queue.Queue()
+        self._decoder = FrameDecoder(self._decoder.num_rows, self._decoder.num_cols)
+        self.start(sock)
+        return True
+
+    def send(self, data: bytes):
+        self._outbox.put(data)
+
+    @staticmethod
+    def _get(q: queue.Queue, timeout: float=0.):
+        """timeout 0 polls, None waits until a packet arrives"""
+        try:
+            return q.get_nowait() if timeout == 0 else q.get(timeout=timeout)
+        except queue.Empty:
+            return None
 
-    @threaded
-    def recv(self, buff_size=GAME_BUFF_SIZE):
-        self._busy = True
+    def get_move(self, timeout: float=0.):
         while True:
-            data = self.sock.recv(buff_size)
-            p = pickle.loads(data)
-            if p:
-                self._data_buffer.append(p)
-                break
-        self._busy = False
+            data = self._get(self._moves, timeout)
+            if data is None or isinstance(data, MovePacket):
+                return None if data is None else data.move
 
-    @threaded
-    def send(self, data):
-        self.sock.send(data)
+    def get_packet(self, timeout: float=0.):
+        """Next packet of the move queue, which holds every packet of an ordered client"""
+        return self._get(self._moves, timeout)
 
-    def _get(self, buff_size=MOVE_BUFF_SIZE):
-        if self.is_busy:
-            return None
-        if self._data_buffer:
-            data = self._pop_data()
-            return data 
-        self.recv(buff_size)
-        return None
-
-    def get_move(self):
-        data = self._get(MOVE_BUFF_SIZE)
-        return data.move if isinstance(data, MovePacket) else None
-
-    def get_game(self):
-        data = self._get(GAME_BUFF_SIZE)
-        return data if isinstance(data, GamePacket) else None
+    def get_game(self, timeout: float=0.):
+        return self._get(self._games, timeout)
             
     def send_move(self, move: Move):
-        self.send(pickle.dumps(MovePacket(id=self.id, move=move)))
-
-    def send_game(self, game_packet):
-        self.send(pickle.dumps(game_packet))
+        self.send(encode_move(MovePacket(id=self.id, move=move), self._decoder.num_rows))
+
+    def send_game(self, game_packet: GamePacket):
+        self._decoder.num_rows, self._decoder.num_cols = game_packet.board_size
+        self.send(encode_game(game_packet))
+
+    def send_sync(self, sync: SyncPacket):
+        self.send(encode_sync(sync))
+
+    def join(self, side: int, match_id: int=0):
+        """Ask a GameServer for a game (any side but KIBITZ) or to watch match_id (KIBITZ)"""
+        self.send(encode_join(JoinPacket(side, match_id)))
+
+    def close(self):
+        self._outbox.put(None)
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
@@ -0,0 +1,118 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Sequence
+
+from .configs import NUM_BLOCKS
+from .bitboard import BitBoard, side_index
+
+
+PV, TT, KILLER, HISTORY, MOBILITY = 'pv', 'tt', 'killer', 'history', 'mobility'
+HEURISTICS = (PV, TT, KILLER, HISTORY, MOBILITY)
+MAX_PLY = NUM_BLOCKS + 1
+NUM_KILLERS = 2
+
+# scores are added up, so that a heuristic always outranks the ones below it
+CAPTURE_SCORE = 1 << 40
+PV_SCORE = 1 << 32
+TT_SCORE = 1 << 31
+KILLER_SCORE = 1 << 24
+# history scores are shifted past the largest mobility (8 neighbours)
+HISTORY_SHIFT = 4
+
+
+class MoveOrderer:
+    """
+    Sorts the moves of a node before they are searched. Moving onto the opponent king always
+    comes first, then the previous principal variation, the table move, killer moves of the
+    same ply, the history table and finally the number of free neighbours of the destination.
+    The caller passes pv_move only at nodes that lie on the previous principal variation,
+    elsewhere the table move comes first
+    """
+    def __init__(self, heuristics: Sequence[str]=HEURISTICS, num_blocks: int=NUM_BLOCKS) -> None:
+        unknown = set(heuristics) - set(HEURISTICS)
+        if unknown:
+            raise ValueError("Unknown heuristics: {}".format(', '.join(sorted(unknown))))
+        self.heuristics = tuple(heuristics)
+        self._use_pv = PV in heuristics
+        self._use_tt = TT in heuristics
+        self._use_killer = KILLER in heuristics
+        self._use_history = HISTORY in heuristics
+        self._use_mobility = MOBILITY in heuristics
+        self._num_blocks = num_blocks
+        self.clear()
+
+    def clear(self):
+        self._killers = [[] for _ in range(MAX_PLY)]
+        self._history = [[0] * self._num_blocks for _ in range(2)]
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    def new_search(self):
+        # killers belong to a position, history is only aged
+        self._killers = [[] for _ in range(MAX_PLY)]
+        self.reset_stats()
+        for hist in self._history:
+            for cell in range(len(hist)):
+                hist[cell] >>= 1
+
+    def order(self, board: BitBoard, moves: List[int], ply: int, tt_move: int=None, pv_move: int=None) -> List[int]:
+        if len(moves) < 2:
+            return moves
+        if board.num_blocks > self._num_blocks:
+            self._num_blocks = board.num_blocks
+            self.clear()
+        idx = side_index(board.side_to_move)
+        king_them = board.kings[1 - idx]
+        killers = self._killers[ply] if self._use_killer and ply < MAX_PLY else ()
+        hist = self._history[idx] if self._use_history else None
+        if not self._use_pv:
+            pv_move = None
+        if not self._use_tt:
+            tt_move = None
+        scored = []
+        for move in moves:
+            if move == king_them:
+                score = CAPTURE_SCORE
+            else:
+                score = 0
+                if move == pv_move:
+                    score += PV_SCORE
+                if move == tt_move:
+                    score += TT_SCORE
+                if move in killers:
+                    score += KILLER_SCORE >> killers.index(move)
+                if hist is not None:
+                    score += min(hist[move] << HISTORY_SHIFT, (KILLER_SCORE >> NUM_KILLERS) - 1)
+                if self._use_mobility:
+                    score += board.count_move(move)
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def cutoff(self, board: BitBoard, move: int, ply: int, depth: int, index: int):
+        """The index-th move searched at this node failed high"""
+        self.cutoffs += 1
+        if index == 0:
+            self.first_move_cutoffs += 1
+        if self._use_killer and ply < MAX_PLY:
+            killers = self._killers[ply]
+            if move not in killers:
+                killers.insert(0, move)
+                del killers[NUM_KILLERS:]
+        if self._use_history:
+            self._history[side_index(board.side_to_move)][move] += depth * depth
+
+    @property
+    def first_move_rate(self) -> float:
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.
+
+    def stats(self) -> str:
+        return 'ordering: cutoffs {} first move {} ({:.1%})'.format(
+            self.cutoffs, self.first_move_cutoffs, self.first_move_rate)
@@ -0,0 +1,114 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Tuple
+from time import time
+
+import os
+import multiprocessing as mp
+
+from .configs import *
+from .bitboard import BitBoard
+from .search import Searcher
+from .ordering import HEURISTICS
+
+
+_searcher = None
+
+
+def _init_worker(algorithm: str, tt_size: int, aspiration: int, ordering):
+    # every worker keeps its own searcher, so its table survives from one move to the next
+    global _searcher
+    _searcher = Searcher(algorithm, tt_size, aspiration=aspiration, ordering=ordering)
+
+
+def _search_child(args):
+    packed, move, max_depth, min_depth, deadline = args
+    board = BitBoard(*packed)
+    board.do_move(move)
+    if max_depth < 1:
+        return move, [(0, board.evaluate(), [])]
+    results = []
+    budget = None if deadline is None else max(0., deadline - time())
+    _searcher.iterate(board, max_depth, budget, max(1, min(min_depth, max_depth)), callback=lambda depth, val, seq: results.append((depth, val, seq)))
+    return move, results
+
+
+def pack_board(board: BitBoard) -> tuple:
+    return (board.num_rows, board.num_cols, board.fog, board.kings[0], board.kings[1],
+            board.side_to_move, list(board.traces))
+
+
+class ParallelSearcher:
+    """
+    Root splitting over a process pool: every root move is searched by iterative deepening
+    in a worker, and the root result is taken from the deepest iteration all moves completed.
+    Has the same iterate interface as Searcher
+    """
+    def __init__(self, algorithm: str='negamax', workers: int=None, tt_size: int=TT_SIZE,
+                 verbose: bool=False, aspiration: int=None, ordering=HEURISTICS) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.verbose = verbose
+        self._init_args = (algorithm, tt_size, aspiration, ordering)
+        # hidden opponent kings and trivial positions are searched in process
+        self._local = Searcher(algorithm, tt_size, verbose, aspiration, ordering)
+        self._pool = None
+        self.depth = 0
+
+    @property
+    def tt(self):
+        return self._local.tt
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = mp.Pool(self.workers, initializer=_init_worker, initargs=self._init_args)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __del__(self):
+        self.close()
+
+    def iterate(self, board: BitBoard, max_depth: int=AI_DEPTH, budget: float=None,
+                min_depth: int=1) -> Tuple[int, List[int]]:
+        moves = board.gen_moves()
+        if board.king(-board.side_to_move) < 0 or len(moves) < 2 or board.evaluate() in (WIN, LOSS):
+            res = self._local.iterate(board, max_depth, budget, min_depth)
+            self.depth = self._local.depth
+            return res
+
+        start = time()
+        deadline = None if budget is None else start + budget
+        packed = pack_board(board)
+        # children are one ply shallower than the root moves they answer
+        tasks = [(packed, move, max_depth - 1, min_depth - 1, deadline) for move in moves]
+        results = dict(self.pool.map(_search_child, tasks))
+
+        # a root move's result at depth d comes from its child's iteration at depth d - 1,
+        # a won or lost child stays final for every deeper iteration
+        depth = max_depth
+        for res in results.values():
+            last_depth, last_val, _ = res[-1]
+            if last_val not in (WIN, LOSS):
+                depth = min(depth, last_depth + 1)
+        opt_val, opt_seq = LOSS - 1, []
+        for move, res in results.items():
+            _, val, seq = res[0]
+            for d, v, s in res:
+                if d + 1 <= depth:
+                    val, seq = v, s
+            if -val > opt_val:
+                opt_val, opt_seq = -val, seq + [move]
+        self.depth = depth
+        if self.verbose:
+            print('parallel: {} moves on {} workers, depth {} value {} time {:.3f}'.format(
+                len(moves), self.workers, depth, opt_val, time() - start))
+        return opt_val, opt_seq
@@ -0,0 +1,178 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Tuple
+from dataclasses import dataclass
+
+import struct
+
+from .base import *
+from .utils import rc_2_pos, pos_2_rc
+from .bitboard import BitBoard, popcount
+
+
+VERSION = 1
+MSG_MOVE, MSG_GAME, MSG_JOIN, MSG_SYNC = 1, 2, 3, 4
+# version, message type, payload length
+HEADER = struct.Struct('!BBH')
+# side, cell
+MOVE = struct.Struct('!bB')
+# side, game mode, game type, rows, cols, red king, black king, side to move; the fog bitmask follows
+GAME = struct.Struct('!bBBBBBBb')
+# side wanted (KIBITZ to watch), match to watch; 0 is any
+JOIN = struct.Struct('!bI')
+# ply, Zobrist key of the position after ply moves, whether the sender asks to be brought up to date
+SYNC = struct.Struct('!HQ?')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+@dataclass
+class MovePacket:
+    move: Move
+    id: str=''
+
+
+@dataclass
+class GamePacket:
+    side: int
+    game_mode: Game_Mode
+    game_type: Game_Type
+    red_king_pos: Position
+    black_king_pos: Position
+    fog: int
+    board_size: Tuple[int, int]
+    side_to_move: int=RED
+
+
+@dataclass
+class JoinPacket:
+    side: int
+    match_id: int=0
+
+
+@dataclass
+class SyncPacket:
+    ply: int
+    key: int
+    request: bool=False
+
+
+def sync_packet(board: Board, request: bool=False) -> SyncPacket:
+    """Where board stands: every move unfogs one cell, so the ply is the number of unfogged cells"""
+    bb = BitBoard.from_board(board)
+    return SyncPacket(popcount(bb.full_mask ^ bb.fog), bb.key, request)
+
+
+def frame(msg_type: int, payload: bytes) -> bytes:
+    if len(payload) > 0xffff:
+        raise ProtocolError('Payload too large: {} bytes'.format(len(payload)))
+    return HEADER.pack(VERSION, msg_type, len(payload)) + payload
+
+
+def encode_move(packet: MovePacket, num_rows: int=NUM_ROWS) -> bytes:
+    move = packet.move
+    return frame(MSG_MOVE, MOVE.pack(move.side, rc_2_pos(move.pos.row, move.pos.col, num_rows)) + packet.id.encode())
+
+
+def encode_game(packet: GamePacket) -> bytes:
+    num_rows, num_cols = packet.board_size
+    red = rc_2_pos(packet.red_king_pos.row, packet.red_king_pos.col, num_rows)
+    black = rc_2_pos(packet.black_king_pos.row, packet.black_king_pos.col, num_rows)
+    fog = packet.fog.to_bytes((num_rows * num_cols + 7) // 8, 'big')
+    return frame(MSG_GAME, GAME.pack(packet.side, Game_Mode(packet.game_mode).value, Game_Type(packet.game_type).value,
+                                     num_rows, num_cols, red, black, packet.side_to_move) + fog)
+
+
+def encode_join(packet: JoinPacket) -> bytes:
+    return frame(MSG_JOIN, JOIN.pack(packet.side, packet.match_id))
+
+
+def encode_sync(packet: SyncPacket) -> bytes:
+    return frame(MSG_SYNC, SYNC.pack(packet.ply, packet.key, packet.request))
+
+
+def encode_packet(packet, num_rows: int=NUM_ROWS) -> bytes:
+    if isinstance(packet, MovePacket):
+        return encode_move(packet, num_rows)
+    if isinstance(packet, GamePacket):
+        return encode_game(packet)
+    if isinstance(packet, JoinPacket):
+        return encode_join(packet)
+    if isinstance(packet, SyncPacket):
+        return encode_sync(packet)
+    raise ProtocolError('Unknown packet: {}'.format(type(packet).__name__))
+
+
+def check_cell(cell: int, num_rows: int, num_cols: int):
+    if cell >= num_rows * num_cols:
+        raise ProtocolError('Cell {} is off a {}x{} board'.format(cell, num_rows, num_cols))
+
+
+def decode_move(payload: bytes, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> MovePacket:
+    side, cell = MOVE.unpack_from(payload)
+    check_cell(cell, num_rows, num_cols)
+    row, col = pos_2_rc(cell, num_rows)
+    return MovePacket(Move(side, Position(row, col)), payload[MOVE.size:].decode())
+
+
+def decode_game(payload: bytes) -> GamePacket:
+    side, game_mode, game_type, num_rows, num_cols, red, black, side_to_move = GAME.unpack_from(payload)
+    if num_rows == 0 or num_cols == 0:
+        raise ProtocolError('Empty board: {}x{}'.format(num_rows, num_cols))
+    check_cell(red, num_rows, num_cols)
+    check_cell(black, num_rows, num_cols)
+    if len(payload) - GAME.size != (num_rows * num_cols + 7) // 8:
+        raise ProtocolError('Fog of {} bytes for a {}x{} board'.format(len(payload) - GAME.size, num_rows, num_cols))
+    fog = int.from_bytes(payload[GAME.size:], 'big')
+    return GamePacket(side, Game_Mode(game_mode), Game_Type(game_type), Position(*pos_2_rc(red, num_rows)),
+                      Position(*pos_2_rc(black, num_rows)), fog, (num_rows, num_cols), side_to_move)
+
+
+class FrameDecoder:
+    """
+    Reassembles packets from a byte stream that may be split or coalesced anywhere.
+    Move cells are decoded with the board size of the last game packet seen, or with a fixed
+    board size when track_size is off, as on the server, whose peers do not set up games
+    """
+    def __init__(self, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS, track_size: bool=True) -> None:
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.track_size = track_size
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List:
+        self._buffer += data
+        packets = []
+        while len(self._buffer) >= HEADER.size:
+            version, msg_type, length = HEADER.unpack_from(self._buffer)
+            if version != VERSION:
+                raise ProtocolError('Unsupported protocol version {}'.format(version))
+            if len(self._buffer) < HEADER.size + length:
+                break
+            payload = bytes(self._buffer[HEADER.size:HEADER.size + length])
+            del self._buffer[:HEADER.size + length]
+            packets.append(self.decode(msg_type, payload))
+        return packets
+
+    def decode(self, msg_type: int, payload: bytes):
+        try:
+            if msg_type == MSG_MOVE:
+                return decode_move(payload, self.num_rows, self.num_cols)
+            if msg_type == MSG_GAME:
+                packet = decode_game(payload)
+                if self.track_size:
+                    self.num_rows, self.num_cols = packet.board_size
+                return packet
+            if msg_type == MSG_JOIN:
+                return JoinPacket(*JOIN.unpack(payload))
+            if msg_type == MSG_SYNC:
+                return SyncPacket(*SYNC.unpack(payload))
+        except (struct.error, ValueError, UnicodeDecodeError) as e:
+            raise ProtocolError('Malformed packet: {}'.format(e))
+        raise ProtocolError('Unknown message type {}'.format(msg_type))
@@ -0,0 +1,136 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Iterator, Callable, Tuple
+from dataclasses import dataclass, field
+
+import os
+import struct
+
+from .configs import *
+
+
+MAGIC = b'KCR'
+VERSION = 1
+# magic, version, num_rows, num_cols
+HEADER = struct.Struct('<3sBBB')
+# red king, black king, first side to move, winner, number of moves
+RECORD = struct.Struct('<BBbbH')
+READ_SIZE = 1 << 16
+
+
+@dataclass
+class GameRecord:
+    red_king: int
+    black_king: int
+    win_side: int
+    moves: List[int] = field(default_factory=list)
+    side_to_move: int = RED
+
+    def pack(self) -> bytes:
+        return RECORD.pack(self.red_king, self.black_king, self.side_to_move, self.win_side,
+                           len(self.moves)) + bytes(self.moves)
+
+
+class RecordFormatError(Exception):
+    pass
+
+
+def read_header(f) -> Tuple[int, int]:
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise RecordFormatError('Truncated header')
+    magic, version, num_rows, num_cols = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise RecordFormatError('Not a game record file (version {})'.format(version))
+    return num_rows, num_cols
+
+
+class RecordWriter:
+    """
+    Append-only writer of game records: a header, then one fixed size record head
+    and one byte per move (a cell index) for every game
+    """
+    def __init__(self, file_name: str, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS, append: bool=False) -> None:
+        self.file_name = file_name
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        exists = append and os.path.exists(file_name) and os.path.getsize(file_name) > 0
+        if exists:
+            with open(file_name, 'rb') as f:
+                if read_header(f) != (num_rows, num_cols):
+                    raise RecordFormatError('Board size does not match {}'.format(file_name))
+        self._file = open(file_name, 'ab' if exists else 'wb')
+        if not exists:
+            self._file.write(HEADER.pack(MAGIC, VERSION, num_rows, num_cols))
+
+    @property
+    def offset(self) -> int:
+        return self._file.tell()
+
+    def write(self, record: GameRecord):
+        self._file.write(record.pack())
+
+    def write_raw(self, f):
+        """Append every record of the open record file f, without decoding them"""
+        read_header(f)
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def sync(self):
+        """Flush and make sure everything written so far is on disk"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_records(file_name: str, predicate: Callable[[GameRecord], bool]=None) -> Iterator[GameRecord]:
+    """Stream the records of file_name, skipping those predicate rejects; a truncated last record is ignored"""
+    with open(file_name, 'rb') as f:
+        read_header(f)
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            red_king, black_king, side_to_move, win_side, num_moves = RECORD.unpack(head)
+            moves = f.read(num_moves)
+            if len(moves) < num_moves:
+                return
+            record = GameRecord(red_king, black_king, win_side, list(moves), side_to_move)
+            if predicate is None or predicate(record):
+                yield record
+
+
+def count_records(file_name: str, predicate: Callable[[GameRecord], bool]=None) -> int:
+    if predicate is not None:
+        return sum(1 for _ in iter_records(file_name, predicate))
+    # only the record heads are read
+    res = 0
+    with open(file_name, 'rb') as f:
+        read_header(f)
+        size = os.fstat(f.fileno()).st_size
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return res
+            num_moves = RECORD.unpack(head)[-1]
+            if f.seek(num_moves, 1) > size:
+                return res
+            res += 1
@@ -0,0 +1,322 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Tuple
+from time import time
+
+from .configs import *
+from .bitboard import BitBoard
+from .ttable import TranspositionTable, EXACT, LOWER, UPPER
+from .ordering import MoveOrderer, HEURISTICS
+from .symmetry import symmetry as board_symmetry
+
+
+TIME_CHECK_NODES = 1024
+ALGORITHMS = ('minimax', 'alpha_beta', 'negamax', 'pvs')
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Searcher:
+    """
+    Game tree search on a BitBoard. Results are (value, seq) where seq holds the
+    principal variation in reverse order, i.e. the root move is seq[-1].
+    With symmetry, positions related by a board symmetry share one table entry
+    """
+    def __init__(self, algorithm: str='negamax', tt_size: int=TT_SIZE, verbose: bool=False,
+                 aspiration: int=None, ordering=HEURISTICS, symmetry: bool=False) -> None:
+        if algorithm not in ALGORITHMS:
+            raise ValueError("Unknown algorithm: {}".format(algorithm))
+        self.algorithm = algorithm
+        self._algorithm = getattr(self, algorithm)
+        self.aspiration = aspiration
+        self.tt = TranspositionTable(tt_size)
+        self.orderer = MoveOrderer(ordering)
+        self.symmetry = symmetry
+        self._symmetry = None
+        self.verbose = verbose
+        self.nodes = 0
+        # an Event that, once set, ends the search like a timeout
+        self.stop_event = None
+        self._deadline = None
+        self._root_depth = 0
+        self._pv = []
+        # whether the line being searched still follows _pv, the previous iteration's principal variation
+        self._on_pv = False
+
+    def _tick(self):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES:
+            return
+        if self._deadline is not None and time() > self._deadline or self._stopped():
+            raise SearchTimeout()
+
+    def _stopped(self) -> bool:
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def _order(self, board: BitBoard, moves: List[int], depth: int, entry) -> List[int]:
+        ply = self._root_depth - depth
+        pv_move = self._pv[ply] if self._on_pv and ply < len(self._pv) else None
+        moves = self.orderer.order(board, moves, ply, None if entry is None else entry[4], pv_move)
+        # only the first move of a node on the line can continue it; the loops leave the line after it
+        self._on_pv = pv_move is not None and moves[0] == pv_move
+        return moves
+
+    def _cutoff(self, board: BitBoard, move: int, depth: int, index: int):
+        self.orderer.cutoff(board, move, self._root_depth - depth, depth, index)
+
+    def _tt_probe(self, board: BitBoard):
+        """(key, t, entry): the table key of board, its transform to the canonical position and the entry found"""
+        if not self.symmetry:
+            return board.key, 0, self.tt.probe(board.key)
+        sym = self._symmetry
+        if sym is None or (sym.num_rows, sym.num_cols) != (board.num_rows, board.num_cols):
+            sym = self._symmetry = board_symmetry(board.num_rows, board.num_cols)
+        key, t = sym.canonical_key(board)
+        entry = self.tt.probe(key)
+        if t and entry is not None and entry[4] is not None:
+            # the stored move is a cell of the canonical position
+            entry = entry[:4] + (sym.inverses[t][entry[4]],) + entry[5:]
+        return key, t, entry
+
+    def _tt_store(self, key: int, t: int, depth: int, val: int, bound: int, move: int):
+        if t and move is not None:
+            move = self._symmetry.perms[t][move]
+        self.tt.store(key, depth, val, bound, move)
+
+    def minimax(self, board: BitBoard, depth: int, lo: int=LOSS, hi: int=WIN) -> Tuple[int, List[int]]:
+        """Full width negamax, lo and hi are ignored"""
+        self._tick()
+        opt_val = board.evaluate()
+        if depth == 0 or opt_val == LOSS or opt_val == WIN:
+            return (opt_val, [])
+        key, t, entry = self._tt_probe(board)
+        if entry is not None and entry[1] >= depth and entry[3] == EXACT:
+            return (entry[2], [] if entry[4] is None else [entry[4]])
+        opt_val, opt_move = WIN, []
+        for i, move in enumerate(self._order(board, board.gen_moves(), depth, entry)):
+            board.do_move(move)
+            res, seq = self.minimax(board, depth - 1, lo, hi)
+            board.undo_move()
+            self._on_pv = False
+            if res <= LOSS:
+                self._cutoff(board, move, depth, i)
+                seq.append(move)
+                self._tt_store(key, t, depth, WIN, EXACT, move)
+                return (WIN, seq)
+            if res <= opt_val:
+                seq.append(move)
+                opt_val = res
+                opt_move = seq
+        self._tt_store(key, t, depth, -opt_val, EXACT, opt_move[-1] if opt_move else None)
+        return (-opt_val, opt_move)
+
+    def alpha_beta(self, board: BitBoard, depth: int, lo: int=LOSS, hi: int=WIN, lohi: int=1) -> Tuple[int, List[int]]:
+        self._tick()
+        if board.king(RED) == board.king(BLACK):
+            return (LOSS * lohi, [])
+        if depth == 0:
+            return (lohi * board.evaluate(), [])
+        moves = board.gen_moves()
+        if len(moves) == 0:
+            return (LOSS * lohi, [])
+        # table values and bounds are kept from the side to move's point of view
+        key, t, entry = self._tt_probe(board)
+        if entry is not None and entry[1] >= depth:
+            val, bound = entry[2] * lohi, entry[3]
+            if lohi < 0 and bound != EXACT:
+                bound = LOWER if bound == UPPER else UPPER
+            if bound == EXACT or (bound == LOWER and val >= hi) or (bound == UPPER and val <= lo):
+                return (val, [] if entry[4] is None else [entry[4]])
+        moves = self._order(board, moves, depth, entry)
+        lo_0, hi_0 = lo, hi
+
+        if lohi > 0:
+            opt_val, opt_seq = LOSS - 1, []
+            for i, move in enumerate(moves):
+                board.do_move(move)
+                val, seq = self.alpha_beta(board, depth - 1, lo, hi, -lohi)
+                board.undo_move()
+                self._on_pv = False
+                if val > opt_val or (val == opt_val and len(seq) < len(opt_seq)):
+                    seq.append(move)
+                    opt_val = val
+                    opt_seq = seq
+                lo = max(lo, opt_val)
+                if lo >= hi:
+                    self._cutoff(board, move, depth, i)
+                    break
+        else:
+            opt_val, opt_seq = WIN + 1, []
+            for i, move in enumerate(moves):
+                board.do_move(move)
+                val, seq = self.alpha_beta(board, depth - 1, lo, hi, -lohi)
+                board.undo_move()
+                self._on_pv = False
+                if val < opt_val or (val == opt_val and len(seq) < len(opt_seq)):
+                    seq.append(move)
+                    opt_val = val
+                    opt_seq = seq
+                hi = min(hi, opt_val)
+                if lo >= hi:
+                    self._cutoff(board, move, depth, i)
+                    break
+        bound = UPPER if opt_val <= lo_0 else LOWER if opt_val >= hi_0 else EXACT
+        if lohi < 0 and bound != EXACT:
+            bound = LOWER if bound == UPPER else UPPER
+        self._tt_store(key, t, depth, opt_val * lohi, bound, opt_seq[-1] if opt_seq else None)
+        return (opt_val, opt_seq)
+
+    def _probe(self, board: BitBoard, depth: int, lo: int, hi: int):
+        key, t, entry = self._tt_probe(board)
+        if entry is not None and entry[1] >= depth:
+            val, bound = entry[2], entry[3]
+            if bound == EXACT or (bound == LOWER and val >= hi) or (bound == UPPER and val <= lo):
+                return key, t, entry, (val, [] if entry[4] is None else [entry[4]])
+        return key, t, entry, None
+
+    def _store(self, key: int, t: int, depth: int, val: int, lo: int, hi: int, seq: List[int]):
+        bound = UPPER if val <= lo else LOWER if val >= hi else EXACT
+        self._tt_store(key, t, depth, val, bound, seq[-1] if seq else None)
+
+    def negamax(self, board: BitBoard, depth: int, lo: int=LOSS, hi: int=WIN) -> Tuple[int, List[int]]:
+        """Fail-soft negamax with alpha-beta pruning"""
+        self._tick()
+        opt_val = board.evaluate()
+        if depth == 0 or opt_val == LOSS or opt_val == WIN:
+            return (opt_val, [])
+        lo_0 = lo
+        key, t, entry, res = self._probe(board, depth, lo, hi)
+        if res is not None:
+            return res
+        opt_val, opt_seq = LOSS - 1, []
+        for i, move in enumerate(self._order(board, board.gen_moves(), depth, entry)):
+            board.do_move(move)
+            val, seq = self.negamax(board, depth - 1, -hi, -lo)
+            board.undo_move()
+            self._on_pv = False
+            val = -val
+            if val > opt_val:
+                seq.append(move)
+                opt_val, opt_seq = val, seq
+                if val > lo:
+                    lo = val
+                    if lo >= hi:
+                        self._cutoff(board, move, depth, i)
+                        break
+        self._store(key, t, depth, opt_val, lo_0, hi, opt_seq)
+        return (opt_val, opt_seq)
+
+    def pvs(self, board: BitBoard, depth: int, lo: int=LOSS, hi: int=WIN) -> Tuple[int, List[int]]:
+        """
+        Principal variation search: the first move gets the full window, the others a null window
+        and a full re-search only when they turn out to be better than the best so far
+        """
+        self._tick()
+        opt_val = board.evaluate()
+        if depth == 0 or opt_val == LOSS or opt_val == WIN:
+            return (opt_val, [])
+        lo_0 = lo
+        key, t, entry, res = self._probe(board, depth, lo, hi)
+        if res is not None:
+            return res
+        opt_val, opt_seq = LOSS - 1, []
+        for i, move in enumerate(self._order(board, board.gen_moves(), depth, entry)):
+            board.do_move(move)
+            if i == 0:
+                val, seq = self.pvs(board, depth - 1, -hi, -lo)
+                val = -val
+            else:
+                val, seq = self.pvs(board, depth - 1, -lo - 1, -lo)
+                val = -val
+                if lo < val < hi:
+                    val, seq = self.pvs(board, depth - 1, -hi, -lo)
+                    val = -val
+            board.undo_move()
+            self._on_pv = False
+            if val > opt_val:
+                seq.append(move)
+                opt_val, opt_seq = val, seq
+                if val > lo:
+                    lo = val
+                    if lo >= hi:
+                        self._cutoff(board, move, depth, i)
+                        break
+        self._store(key, t, depth, opt_val, lo_0, hi, opt_seq)
+        return (opt_val, opt_seq)
+
+    def _search_root(self, board: BitBoard, depth: int, lo: int=LOSS, hi: int=WIN) -> Tuple[int, List[int]]:
+        self._root_depth = depth
+
+        def search():
+            self._on_pv = True
+            return self._algorithm(board, depth, lo, hi)
+
+        if board.king(-board.side_to_move) >= 0:
+            return search()
+        # the opponent king is hidden: try every square it may have moved to
+        opt_val, opt_seq = LOSS - 1, []
+        for king_them in board.gen_moves_from(board.traces[-1]):
+            board.set_king(-board.side_to_move, king_them)
+            val, seq = search()
+            if val > opt_val:
+                opt_val, opt_seq = val, seq
+        board.set_king(-board.side_to_move, -1)
+        return opt_val, opt_seq
+
+    def _aspire(self, board: BitBoard, depth: int, prev_val: int) -> Tuple[int, List[int]]:
+        # narrow window around the previous iteration's score, full re-search when it fails
+        if self.aspiration is None or self.algorithm in ('minimax', 'alpha_beta') or prev_val in (WIN, LOSS):
+            return self._search_root(board.copy(), depth)
+        lo, hi = prev_val - self.aspiration, prev_val + self.aspiration
+        val, seq = self._search_root(board.copy(), depth, lo, hi)
+        if lo < val < hi:
+            return val, seq
+        return self._search_root(board.copy(), depth)
+
+    def search(self, board: BitBoard, depth: int=AI_DEPTH) -> Tuple[int, List[int]]:
+        return self.iterate(board, max_depth=depth, min_depth=depth)
+
+    def iterate(self, board: BitBoard, max_depth: int=AI_DEPTH, budget: float=None,
+                min_depth: int=1, callback=None) -> Tuple[int, List[int]]:
+        """
+        Iterative deepening: search depth min_depth, min_depth + 1, ... max_depth and return
+        the result of the last completed iteration once budget (seconds) runs out.
+        The first iteration always completes, so that there is a move to play, unless stop_event is set.
+        callback(depth, value, seq) is called after every completed iteration
+        """
+        start = time()
+        self.tt.new_search()
+        self.orderer.new_search()
+        self.nodes = 0
+        self._pv = []
+        opt_val, opt_seq, self.depth = LOSS, [], 0
+        for depth in range(min_depth, max_depth + 1):
+            if self._stopped():
+                break
+            self._deadline = None if budget is None or depth == min_depth else start + budget
+            try:
+                if depth == min_depth:
+                    val, seq = self._search_root(board.copy(), depth)
+                else:
+                    val, seq = self._aspire(board, depth, opt_val)
+            except SearchTimeout:
+                break
+            opt_val, opt_seq, self.depth = val, seq, depth
+            self._pv = seq[::-1]
+            if callback is not None:
+                callback(depth, val, seq)
+            if self.verbose:
+                print('depth {} value {} nodes {} time {:.3f}'.format(depth, val, self.nodes, time() - start))
+            if val == WIN or val == LOSS:
+                break
+        self._deadline = None
+        if self.verbose:
+            print(self.tt.stats())
+            print(self.orderer.stats())
+        return opt_val, opt_seq
@@ -0,0 +1,333 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from collections import deque
+from time import time
+
+import argparse
+import asyncio
+import socket
+
+from .configs import *
+from .base import Move, Move_Type
+from .clock import TimeControl
+from .game_model import KingGameModel
+from .protocol import *
+from .network import HOST, PORT, MAX_CLIENTS
+
+
+READ_SIZE = 4096
+INC_PER_MOVE = 2
+# connections that do not say whether they play or watch are paired as players after this
+JOIN_TIMEOUT = 0.2
+# bytes an observer may have queued before it stops getting moves
+OBSERVER_BUFFER = 1 << 16
+# seconds a lagging observer may take to drain before it is dropped
+OBSERVER_MAX_LAG = 10.
+# seconds between two snapshots a player can get by sending syncs
+RESYNC_INTERVAL = 1.
+
+
+class Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.decoder = FrameDecoder(track_size=False)
+        self.match = None
+        self.side = KIBITZ
+        self.joined = False
+        self.lagging_since = None
+        self.resynced_at = None
+        self.closed = False
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data: bytes):
+        if not self.closed:
+            self.writer.write(data)
+
+    @property
+    def buffered(self) -> int:
+        return self.writer.transport.get_write_buffer_size()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class Match:
+    """
+    One game between two connections, replayed until a player leaves. Moves are validated on the
+    server's own board and the side to move's clock runs while the server waits for its move
+    """
+    def __init__(self, server, match_id: int, red: Connection, black: Connection, game_type=Game_Type.VISIBLE,
+                 total_time: int=GAME_TIME, inc_per_move: int=INC_PER_MOVE) -> None:
+        self.server = server
+        self.id = match_id
+        self.players = {RED: red, BLACK: black}
+        self.observers = set()
+        red.side, black.side = RED, BLACK
+        red.match = black.match = self
+        self.game = KingGameModel(game_mode=Game_Mode.MAN_VS_MAN, game_type=game_type)
+        self.time_control = TimeControl(total_time=total_time, inc_per_move=inc_per_move, sec_to_ticks=SEC_TO_TICKS)
+        self._moves = asyncio.Queue()
+        self.closed = False
+        self.games_played = 0
+
+    @property
+    def board(self):
+        return self.game.board
+
+    def snapshot(self, side: int) -> GamePacket:
+        board = self.board
+        return GamePacket(side, self.game.game_mode, self.game.game_type, board.red_king_pos, board.black_king_pos,
+                          board.fog_mask(), (board.num_rows, board.num_cols), board.side_to_move)
+
+    def send_snapshot(self, conn: Connection):
+        conn.send(encode_game(self.snapshot(conn.side)))
+
+    def new_game(self):
+        self.game.reset(side_to_move=RED)
+        self.time_control.reset()
+        for conn in self.players.values():
+            self.send_snapshot(conn)
+        self.broadcast(encode_game(self.snapshot(KIBITZ)))
+
+    def watch(self, conn: Connection):
+        conn.match, conn.side = self, KIBITZ
+        self.observers.add(conn)
+        self.send_snapshot(conn)
+
+    def broadcast(self, data: bytes):
+        """
+        Send data, encoded once, to every observer. An observer whose send buffer is full skips
+        packets until it has drained, then catches up with a snapshot; one that does not drain is dropped
+        """
+        stats = self.server.stats
+        now = time()
+        for conn in list(self.observers):
+            if conn.closed:
+                self.observers.discard(conn)
+            elif conn.lagging_since is None:
+                if conn.buffered + len(data) > OBSERVER_BUFFER:
+                    conn.lagging_since = now
+                    stats['observer_lags'] += 1
+                else:
+                    conn.send(data)
+            elif conn.buffered <= OBSERVER_BUFFER // 4:
+                conn.lagging_since = None
+                self.send_snapshot(conn)
+                stats['observer_catchups'] += 1
+            elif now - conn.lagging_since > OBSERVER_MAX_LAG:
+                self.observers.discard(conn)
+                conn.close()
+                stats['observer_drops'] += 1
+
+    def on_move(self, conn: Connection, packet: MovePacket):
+        self._moves.put_nowait((conn, packet.move))
+
+    def on_sync(self, conn: Connection, packet: SyncPacket):
+        self._moves.put_nowait((conn, packet))
+
+    def on_position(self, conn: Connection, sync: SyncPacket):
+        """
+        A player that asks, or that stands at the same ply with another position, gets a snapshot,
+        at most one every RESYNC_INTERVAL
+        """
+        own = sync_packet(self.board)
+        if not (sync.request or sync.ply == own.ply) or (sync.ply, sync.key) == (own.ply, own.key):
+            return
+        now = time()
+        if conn.resynced_at is not None and now - conn.resynced_at < RESYNC_INTERVAL:
+            return
+        conn.resynced_at = now
+        self.server.stats['resyncs'] += 1
+        self.send_snapshot(conn)
+
+    def leave(self, conn: Connection):
+        if conn.side == KIBITZ:
+            self.observers.discard(conn)
+            return
+        self.closed = True
+        self._moves.put_nowait((conn, None))
+
+    def game_over(self, win_side: int):
+        self.games_played += 1
+        self.server.stats['games'] += 1
+        self.new_game()
+
+    async def run(self):
+        self.new_game()
+        while not self.closed:
+            try:
+                conn, move = await asyncio.wait_for(self._moves.get(), max(self.time_control.seconds_left, 0.))
+            except asyncio.TimeoutError:
+                self.server.stats['flags'] += 1
+                self.game_over(-self.board.side_to_move)
+                continue
+            if move is None:
+                break
+            # the clock runs whatever the side to move sends, syncs included
+            self.time_control.sync()
+            if self.time_control.is_time_over:
+                self.server.stats['flags'] += 1
+                self.game_over(-self.board.side_to_move)
+                continue
+            if isinstance(move, SyncPacket):
+                self.on_position(conn, move)
+                continue
+            if conn.side != self.board.side_to_move or move.side != conn.side or \
+                    self.board.check_move(move) == Move_Type.INVALID:
+                # a stale or bad move: put the sender back in sync
+                self.server.stats['invalid'] += 1
+                self.send_snapshot(conn)
+                continue
+            m = self.board.make_move(Move(move.side, move.pos))
+            self.time_control.move()
+            self.server.stats['moves'] += 1
+            data = encode_move(MovePacket(move), self.board.num_rows)
+            self.players[-conn.side].send(data)
+            self.broadcast(data)
+            if m == Move_Type.WIN:
+                self.game_over(conn.side)
+        self.server.end_match(self)
+
+
+class GameServer:
+    """
+    Headless asyncio server: pairs incoming connections into matches, in arrival order,
+    lets observers watch running matches and serves at most max_clients connections at once.
+    A connection plays or watches after sending a JoinPacket, or plays after JOIN_TIMEOUT
+    """
+    def __init__(self, host: str=HOST, port: int=PORT, max_clients: int=MAX_CLIENTS,
+                 game_type=Game_Type.VISIBLE, total_time: int=GAME_TIME, inc_per_move: int=INC_PER_MOVE) -> None:
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.game_type = Game_Type(game_type)
+        self.total_time = total_time
+        self.inc_per_move = inc_per_move
+        self.connections = set()
+        self.matches = {}
+        self._waiting = deque()
+        self._server = None
+        self._next_match_id = 1
+        self.stats = dict(connections=0, rejected=0, matches=0, games=0, moves=0, invalid=0, flags=0, bad_packets=0, resyncs=0,
+                          observers=0, observer_lags=0, observer_catchups=0, observer_drops=0)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=self.max_clients)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        for conn in list(self.connections):
+            conn.close()
+
+    def _pair(self, conn: Connection):
+        while self._waiting and self._waiting[0].closed:
+            self._waiting.popleft()
+        if not self._waiting:
+            self._waiting.append(conn)
+            return
+        match = Match(self, self._next_match_id, self._waiting.popleft(), conn, self.game_type,
+                      self.total_time, self.inc_per_move)
+        self._next_match_id += 1
+        self.matches[match.id] = match
+        self.stats['matches'] += 1
+        asyncio.get_running_loop().create_task(match.run())
+
+    def end_match(self, match: Match):
+        self.matches.pop(match.id, None)
+        # players still connected go back to the queue for a new opponent, observers are let go
+        for conn in match.players.values():
+            conn.match, conn.side = None, KIBITZ
+            if not conn.closed:
+                self._pair(conn)
+        for conn in match.observers:
+            conn.close()
+        match.observers.clear()
+
+    def _join(self, conn: Connection, packet: JoinPacket=None):
+        if conn.joined or conn.closed:
+            return
+        conn.joined = True
+        if packet is None or packet.side != KIBITZ:
+            self._pair(conn)
+            return
+        # match 0 means the most watched one
+        if packet.match_id:
+            match = self.matches.get(packet.match_id)
+        else:
+            match = max(self.matches.values(), key=lambda m: len(m.observers), default=None)
+        if match is None:
+            conn.close()
+            return
+        self.stats['observers'] += 1
+        match.watch(conn)
+
+    def on_packet(self, conn: Connection, packet):
+        if isinstance(packet, MovePacket) and conn.match is not None and conn.side != KIBITZ:
+            conn.match.on_move(conn, packet)
+        elif isinstance(packet, SyncPacket) and conn.match is not None and conn.side != KIBITZ:
+            conn.match.on_sync(conn, packet)
+        elif isinstance(packet, JoinPacket):
+            self._join(conn, packet)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self.connections) >= self.max_clients:
+            self.stats['rejected'] += 1
+            writer.close()
+            return
+        conn = Connection(reader, writer)
+        self.connections.add(conn)
+        self.stats['connections'] += 1
+        asyncio.get_running_loop().call_later(JOIN_TIMEOUT, self._join, conn)
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                for packet in conn.decoder.feed(data):
+                    self.on_packet(conn, packet)
+                await writer.drain()
+        except ProtocolError:
+            self.stats['bad_packets'] += 1
+        except ConnectionError:
+            pass
+        finally:
+            conn.close()
+            self.connections.discard(conn)
+            if conn.match is not None:
+                conn.match.leave(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max_clients', type=int, default=MAX_CLIENTS)
+    parser.add_argument('--type', type=int, choices=[0, 1], default=0, help='Game type. 0 = visible; 1 = invisible')
+    args = parser.parse_args()
+
+    server = GameServer(args.host, args.port, args.max_clients, args.type)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,41 @@
 import os
 
-from dataclasses import dataclass
 from typing import List
 
 import pickle
+import random
+import multiprocessing as mp
 
 from .game_model import *
 from .agent import AI
+from .record import GameRecord, RecordWriter, iter_records
+from .symmetry import UniqueGames
+from .utils import rc_2_pos
 
 
-@dataclass
-class Game_Result:
-    game_state: Game_State
-    win_side: int
+CHECKPOINT_EVERY = 100
+
+
+def _simulate_shard(args):
+    file_name, stupidity, num_games, seed, checkpoint_every = args
+    sim = Simulator(file_name=file_name, stupidity=stupidity)
+    # a shard keeps its last checkpoint: one without any starts over, an interrupted one continues
+    # from its checkpoint and a finished one is left alone
+    ckpt = sim.load_checkpoint()
+    if ckpt is None:
+        sim.simulate(num_games, seed=seed, checkpoint_every=checkpoint_every, keep_checkpoint=True)
+    elif ckpt['games_done'] < ckpt['num_games']:
+        sim.resume(keep_checkpoint=True)
+    return sim.file_name
 
 
 class Simulator:
-    def __init__(self, game: KingGameModel = None, file_name: str = 'sim_run_nega') -> None:
+    def __init__(self, game: KingGameModel = None, file_name: str = 'sim_run_nega', stupidity: str = 'negamax') -> None:
         if game is None:
             game = KingGameModel(game_mode=Game_Mode.AI_VS_AI, game_type=Game_Type.VISIBLE)
         self._game = game
-        self.player = AI(stupidity='negamax')
+        self.stupidity = stupidity
+        self.player = AI(stupidity=stupidity)
         f_name = os.path.dirname(os.path.abspath(__file__))
         f_name = os.path.join(f_name, '../data/')
         f_name = os.path.abspath(os.path.join(f_name, file_name))
@@ -30,16 +45,21 @@ class Simulator:
     def num_actions(self):
         return 8
 
-    def _play_single_game(self, state: Game_State = None) -> Game_Result:
+    def _play_single_game(self, state: Game_State = None) -> GameRecord:
         win_side = None
         if state is None:
             self._game.reset()
             state = self._game.get_state()
         else:
             self._game.from_state(state)
+        nr = state.num_rows
+        record = GameRecord(rc_2_pos(state.red_king_pos.row, state.red_king_pos.col, nr),
+                            rc_2_pos(state.black_king_pos.row, state.black_king_pos.col, nr),
+                            0, side_to_move=state.side_to_move)
         while True:
             state = self._game.get_state()
             move = self.player.get_move_now(state)
+            record.moves.append(rc_2_pos(move.pos.row, move.pos.col, nr))
             m = self._game.make_move(move)
             if m == Move_Type.WIN:
                 win_side = -self._game.side_to_move
@@ -48,21 +68,147 @@ class Simulator:
                 win_side = self._game.side_to_move
                 break
 
-        return Game_Result(state, win_side)
+        record.win_side = win_side
+        return record
+
+    def shard_name(self, idx: int) -> str:
+        return '{}.{}'.format(self.file_name, idx)
+
+    def _writer(self, append: bool = False) -> RecordWriter:
+        board = self._game.board
+        return RecordWriter(self.file_name, board.num_rows, board.num_cols, append=append)
+
+    @property
+    def checkpoint_name(self) -> str:
+        return self.file_name + '.ckpt'
+
+    def simulate(self, num_games: int = 1, workers: int = 1, seed: int = None,
+                 checkpoint_every: int = CHECKPOINT_EVERY, keep_checkpoint: bool = False):
+        """
+        Play num_games and stream them to the record file file_name. With workers > 1 the games are
+        spread over a process pool, worker i seeds random with seed + i, writes its own shard and
+        the shards are merged at the end. Progress is checkpointed every checkpoint_every games,
+        an interrupted run is continued by resume(). With keep_checkpoint the last checkpoint,
+        which shows the run complete, is kept rather than removed
+        """
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        # no games to spread: the file is written, empty, by the sequential path
+        if workers > 1 and num_games > 0:
+            return self._simulate_parallel(num_games, workers, seed, checkpoint_every)
+        if seed is not None:
+            random.seed(seed)
+        self._run(num_games, 0, checkpoint_every, keep_checkpoint=keep_checkpoint)
+
+    def _run(self, num_games: int, games_done: int, checkpoint_every: int, append: bool = False,
+             keep_checkpoint: bool = False):
+        with self._writer(append) as writer:
+            if checkpoint_every:
+                self._checkpoint(writer, num_games, games_done, checkpoint_every)
+            while games_done < num_games:
+                writer.write(self._play_single_game())
+                games_done += 1
+                if checkpoint_every and games_done % checkpoint_every == 0 and games_done < num_games:
+                    self._checkpoint(writer, num_games, games_done, checkpoint_every)
+            if keep_checkpoint:
+                self._checkpoint(writer, num_games, games_done, checkpoint_every)
+        if not keep_checkpoint:
+            self._remove_checkpoint()
+
+    def _checkpoint(self, writer: RecordWriter, num_games: int, games_done: int, checkpoint_every: int):
+        # the records must reach the disk before a checkpoint points past them
+        writer.sync()
+        self._save_checkpoint(dict(num_games=num_games, games_done=games_done, offset=writer.offset,
+                                   random_state=random.getstate(), side_to_move=self._game.board.side_to_move,
+                                   checkpoint_every=checkpoint_every))
+
+    def _save_checkpoint(self, ckpt: dict):
+        tmp_name = self.checkpoint_name + '.tmp'
+        with open(tmp_name, 'wb') as f:
+            pickle.dump(ckpt, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, self.checkpoint_name)
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_name):
+            return None
+        with open(self.checkpoint_name, 'rb') as f:
+            return pickle.load(f)
+
+    def _remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_name):
+            os.remove(self.checkpoint_name)
+
+    def _simulate_parallel(self, num_games: int, workers: int, seed: int = None,
+                           checkpoint_every: int = CHECKPOINT_EVERY):
+        if seed is None:
+            seed = random.randrange(1 << 30)
+        workers = max(1, min(workers, num_games))
+        chunks = [num_games // workers + (i < num_games % workers) for i in range(workers)]
+        tasks = [(self.shard_name(i), self.stupidity, chunk, seed + i, checkpoint_every) for i, chunk in enumerate(chunks)]
+        # shards left over from an older run must not be taken as finished
+        for task in tasks:
+            for name in (task[0], task[0] + '.ckpt'):
+                if os.path.exists(name):
+                    os.remove(name)
+        self._save_checkpoint(dict(num_games=num_games, tasks=tasks))
+        self._run_shards(tasks)
+
+    def _run_shards(self, tasks: list):
+        with mp.Pool(len(tasks)) as pool:
+            shards = pool.map(_simulate_shard, tasks)
+        # the run is complete once merged: its checkpoint goes before the shards do, so that
+        # a crash in between never leaves a checkpoint pointing at missing shards
+        self.merge(shards, remove=False)
+        self._remove_checkpoint()
+        for shard in shards:
+            for name in (shard, shard + '.ckpt'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def merge(self, shards: List[str], remove: bool = True):
+        with self._writer() as writer:
+            for shard in shards:
+                with open(shard, 'rb') as f:
+                    writer.write_raw(f)
+            writer.sync()
+        if remove:
+            for shard in shards:
+                os.remove(shard)
+
+    def dedup(self) -> int:
+        """Drop the games that are a board symmetry of an earlier game, returns how many were dropped"""
+        unique = UniqueGames(self._game.board.num_rows, self._game.board.num_cols)
+        tmp_name = self.file_name + '.tmp'
+        with RecordWriter(tmp_name, unique.symmetry.num_rows, unique.symmetry.num_cols) as writer:
+            for record in iter_records(self.file_name, unique):
+                writer.write(record)
+        os.replace(tmp_name, self.file_name)
+        return unique.duplicates
 
-    def simulate(self, num_games: int = 1):
-        games = []
-        for _ in range(num_games):
-            games.append(self._play_single_game())
+    def resume(self, keep_checkpoint: bool = False) -> bool:
+        """
+        Continue an interrupted simulate() from its last checkpoint: games recorded after it
+        are dropped and replayed from the saved random state. Returns False if there is nothing to resume
+        """
+        ckpt = self.load_checkpoint()
+        if ckpt is None:
+            return False
+        if 'tasks' in ckpt:
+            self._run_shards(ckpt['tasks'])
+            return True
+        with open(self.file_name, 'r+b') as f:
+            f.truncate(ckpt['offset'])
+        random.setstate(ckpt['random_state'])
+        self._game.board.side_to_move = ckpt['side_to_move']
+        self._run(ckpt['num_games'], ckpt['games_done'], ckpt['checkpoint_every'], append=True,
+                  keep_checkpoint=keep_checkpoint)
+        return True
 
-        with open(self.file_name, 'wb') as f:
-            pickle.dump(games, f)
-            f.close()
+    def summary(self):
+        num_games = 0
+        for game in iter_records(self.file_name):
+            print(game.win_side)
+            num_games += 1
+        print(num_games)
 
-    def resume(self):
-        with open(self.file_name, 'rb') as f:
-            sim_games = pickle.load(f)
-            for game in sim_games:
-                print(game.win_side)
-            print(len(sim_games))
-            f.close()
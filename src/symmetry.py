@@ -0,0 +1,148 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import List, Tuple
+from functools import lru_cache
+
+from .configs import *
+from .bitboard import BitBoard
+from .record import GameRecord
+from .ttable import zobrist_keys
+from .utils import rc_2_pos, pos_2_rc
+
+
+@lru_cache(maxsize=None)
+def transforms(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> Tuple[Tuple[int, ...], ...]:
+    """
+    Cell permutations of the board's symmetries, the identity first: perm[cell] is where cell goes.
+    A square board has the 8 symmetries of the square, any other board the 4 of a rectangle
+    """
+    nr, nc = num_rows, num_cols
+    maps = [lambda r, c: (r, c), lambda r, c: (nr - 1 - r, c),
+            lambda r, c: (r, nc - 1 - c), lambda r, c: (nr - 1 - r, nc - 1 - c)]
+    if nr == nc:
+        maps += [lambda r, c: (c, r), lambda r, c: (c, nr - 1 - r),
+                 lambda r, c: (nc - 1 - c, r), lambda r, c: (nc - 1 - c, nr - 1 - r)]
+    res = []
+    for f in maps:
+        res.append(tuple(rc_2_pos(*f(*pos_2_rc(cell, nr)), nr) for cell in range(nr * nc)))
+    return tuple(res)
+
+
+def _byte_tables(perm: Tuple[int, ...], values: List[int], num_bytes: int, combine) -> Tuple[Tuple[int, ...], ...]:
+    # tables[k][b]: the values of the cells 8k + i, for every bit i set in b, combined
+    tables = []
+    for k in range(num_bytes):
+        table = [0] * 256
+        for b in range(1, 256):
+            low = b & -b
+            cell = 8 * k + low.bit_length() - 1
+            table[b] = combine(table[b ^ low], values[perm[cell]] if cell < len(perm) else 0)
+        tables.append(tuple(table))
+    return tuple(tables)
+
+
+class Symmetry:
+    """
+    Canonical forms of positions under the board's symmetries. Positions related by a symmetry
+    have the same value, so caches keyed by the canonical key hold up to 8x fewer entries.
+    Transform t maps a position to its canonical form, inverse_cell maps canonical cells back
+    """
+    def __init__(self, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> None:
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.num_blocks = num_rows * num_cols
+        self.perms = transforms(num_rows, num_cols)
+        self.inverses = tuple(tuple(sorted(range(self.num_blocks), key=perm.__getitem__)) for perm in self.perms)
+        # boards of up to 32 cells take the unrolled path of canonical_key
+        self._num_bytes = max(4, (self.num_blocks + 7) // 8)
+        z_fog, z_kings, self._z_side = zobrist_keys(self.num_blocks)
+        bits = [1 << cell for cell in range(self.num_blocks)]
+        xor, bit_or = lambda a, b: a ^ b, lambda a, b: a | b
+        self._fog_keys = tuple(_byte_tables(perm, z_fog, self._num_bytes, xor) for perm in self.perms)
+        self._fog_masks = tuple(_byte_tables(perm, bits, self._num_bytes, bit_or) for perm in self.perms)
+        self._king_keys = tuple(tuple(tuple(z[perm[cell]] for cell in range(self.num_blocks)) + (0,) for z in z_kings)
+                                for perm in self.perms)
+        self._tables = tuple(zip(self._fog_keys, self._king_keys))
+
+    def __len__(self) -> int:
+        return len(self.perms)
+
+    def _chunks(self, fog: int) -> List[int]:
+        return [fog >> (8 * k) & 255 for k in range(self._num_bytes)]
+
+    def transform_fog(self, fog: int, t: int) -> int:
+        res = 0
+        for table, chunk in zip(self._fog_masks[t], self._chunks(fog)):
+            res |= table[chunk]
+        return res
+
+    def transform_cell(self, cell: int, t: int) -> int:
+        return cell if cell < 0 else self.perms[t][cell]
+
+    def inverse_cell(self, cell: int, t: int) -> int:
+        return cell if cell < 0 else self.inverses[t][cell]
+
+    def canonical_key(self, board: BitBoard) -> Tuple[int, int]:
+        """(key, t): the least Zobrist key of the transformed positions and the transform giving it"""
+        fog = board.fog
+        # a hidden king (-1) picks the trailing 0 of the king keys
+        red, black = board.kings
+        side = self._z_side if board.side_to_move == BLACK else 0
+        if self._num_bytes == 4:
+            c0, c1, c2, c3 = fog & 255, fog >> 8 & 255, fog >> 16 & 255, fog >> 24
+            keys = [side ^ rk[red] ^ bk[black] ^ f0[c0] ^ f1[c1] ^ f2[c2] ^ f3[c3]
+                    for (f0, f1, f2, f3), (rk, bk) in self._tables]
+        else:
+            chunks = self._chunks(fog)
+            keys = []
+            for fog_keys, (rk, bk) in self._tables:
+                key = side ^ rk[red] ^ bk[black]
+                for table, chunk in zip(fog_keys, chunks):
+                    key ^= table[chunk]
+                keys.append(key)
+        key = min(keys)
+        return key, keys.index(key)
+
+    def transform(self, board: BitBoard, t: int) -> BitBoard:
+        return BitBoard(board.num_rows, board.num_cols, self.transform_fog(board.fog, t),
+                        self.transform_cell(board.kings[0], t), self.transform_cell(board.kings[1], t),
+                        board.side_to_move, [self.transform_cell(cell, t) for cell in board.traces])
+
+    def canonical(self, board: BitBoard) -> Tuple[BitBoard, int]:
+        _, t = self.canonical_key(board)
+        return self.transform(board, t), t
+
+    def canonical_record(self, record: GameRecord) -> GameRecord:
+        """The least of the transformed copies of a game, the same for every game it is symmetric to"""
+        def image(t):
+            perm = self.perms[t]
+            return GameRecord(perm[record.red_king], perm[record.black_king], record.win_side,
+                              [perm[cell] for cell in record.moves], record.side_to_move)
+        return min((image(t) for t in range(len(self))),
+                   key=lambda r: (r.red_king, r.black_king, r.moves))
+
+
+@lru_cache(maxsize=None)
+def symmetry(num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> Symmetry:
+    return Symmetry(num_rows, num_cols)
+
+
+class UniqueGames:
+    """iter_records predicate that keeps the first of every set of games related by a symmetry"""
+    def __init__(self, num_rows: int=NUM_ROWS, num_cols: int=NUM_COLS) -> None:
+        self.symmetry = symmetry(num_rows, num_cols)
+        self._seen = set()
+        self.duplicates = 0
+
+    def __call__(self, record: GameRecord) -> bool:
+        r = self.symmetry.canonical_record(record)
+        key = (r.red_king, r.black_king, r.side_to_move, tuple(r.moves))
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(key)
+        return True
@@ -0,0 +1,89 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from typing import Tuple
+from functools import lru_cache
+
+import random
+
+from .configs import TT_SIZE
+
+
+EXACT, LOWER, UPPER = 0, 1, 2
+ZOBRIST_SEED = 20230101
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(num_blocks: int) -> Tuple[Tuple[int, ...], Tuple[Tuple[int, ...], Tuple[int, ...]], int]:
+    """
+    Random 64-bit keys for every fog cell, every king square of each side and the side to move.
+    Seeded, so that every process hashes positions identically
+    """
+    rng = random.Random(ZOBRIST_SEED + num_blocks)
+    fog = tuple(rng.getrandbits(64) for _ in range(num_blocks))
+    kings = tuple(tuple(rng.getrandbits(64) for _ in range(num_blocks)) for _ in range(2))
+    return fog, kings, rng.getrandbits(64)
+
+
+class TranspositionTable:
+    """
+    Fixed size hash table of search results, indexed by the low bits of the Zobrist key.
+    An entry is (key, depth, value, bound, move, age); a slot is replaced when it is empty,
+    holds the same position, comes from an older search or was searched less deep
+    """
+    def __init__(self, size: int=TT_SIZE) -> None:
+        size = 1 << max(size - 1, 1).bit_length()
+        self.size = size
+        self._mask = size - 1
+        self._table = [None] * size
+        self._age = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def clear(self):
+        self._table = [None] * self.size
+        self._age = 0
+        self.reset_stats()
+
+    def new_search(self):
+        self._age += 1
+
+    def probe(self, key: int):
+        self.probes += 1
+        entry = self._table[key & self._mask]
+        if entry is None:
+            return None
+        if entry[0] != key:
+            self.collisions += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def store(self, key: int, depth: int, value: int, bound: int, move: int=None):
+        idx = key & self._mask
+        entry = self._table[idx]
+        if entry is not None and entry[0] != key and entry[5] == self._age and entry[1] > depth:
+            return
+        if entry is not None and entry[0] != key:
+            self.overwrites += 1
+        if entry is not None and entry[0] == key and move is None:
+            move = entry[4]
+        self.stores += 1
+        self._table[idx] = (key, depth, value, bound, move, self._age)
+
+    @property
+    def used(self) -> int:
+        return sum(entry is not None for entry in self._table)
+
+    def stats(self) -> str:
+        return 'tt: probes {} hits {} collisions {} stores {} overwrites {}'.format(
+            self.probes, self.hits, self.collisions, self.stores, self.overwrites)
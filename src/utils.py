@@ -10,6 +10,13 @@ from threading import Thread
 from .configs import NUM_ROWS
 
 
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(x: int) -> int:
+        return bin(x).count('1')
+
+
 def rc_2_pos(row: int, col: int, nr=NUM_ROWS) -> int:
     return row + col * nr
 
@@ -17,7 +24,7 @@ def rc_2_pos(row: int, col: int, nr=NUM_ROWS) -> int:
 def pos_2_rc(pos: int, nr=NUM_ROWS) -> Tuple[int, int]:
     row = pos % nr
     col = pos // nr
-    return tuple(row, col)
+    return row, col
 
 
 def threaded(func):
@@ -0,0 +1,41 @@
+"""
+ * Copyright (c) [2023] Minh v. Duong; dvminh82@gmail.com
+ *
+ * You are free to use, modify, re-distribute this code at your own risk
+ */
+"""
+from src.configs import RED
+from src.bitboard import BitBoard
+from src.search import Searcher
+
+
+def _setup(on_pv: bool):
+    board = BitBoard(5, 5, None, 12, 0, RED)
+    moves = board.gen_moves()
+    pv_move, tt_move = moves[0], moves[1]
+    searcher = Searcher('pvs')
+    searcher._root_depth = 3
+    searcher._pv = [pv_move]
+    searcher._on_pv = on_pv
+    entry = (board.key, 1, 0, 0, tt_move)
+    return searcher, board, moves, entry, pv_move, tt_move
+
+
+def test_tt_move_first_off_pv():
+    searcher, board, moves, entry, pv_move, tt_move = _setup(on_pv=False)
+    ordered = searcher._order(board, moves, 3, entry)
+    assert ordered[0] == tt_move
+    assert not searcher._on_pv
+
+
+def test_pv_move_first_on_pv():
+    searcher, board, moves, entry, pv_move, tt_move = _setup(on_pv=True)
+    ordered = searcher._order(board, moves, 3, entry)
+    assert ordered[:2] == [pv_move, tt_move]
+    assert searcher._on_pv
+
+
+def test_search_leaves_pv():
+    searcher = Searcher('pvs')
+    searcher.iterate(BitBoard(5, 5, None, 12, 0, RED), max_depth=4)
+    assert not searcher._on_pv